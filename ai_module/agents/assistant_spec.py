@@ -11,9 +11,11 @@ when use_settings_override is disabled in AI Assistant Settings.
 
 from __future__ import annotations
 
-from typing import Any, Dict, List
-
-import frappe
+import functools
+import threading
+from importlib import resources
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
 
 from .logger_utils import get_resilient_logger
 
@@ -23,96 +25,30 @@ def _log():
 	return get_resilient_logger("ai_module.assistant_spec")
 
 
-# Default system instructions for the AI assistant
-DEFAULT_INSTRUCTIONS = (
-	"Sei l'assistente AI CRM specializzato per {{Cliente}}. Rispondi SEMPRE in ITALIANO, in modo conciso e professionale. "
-	"Quando non sei sicuro, fai domande chiarificatrici. "
-	"\n\n"
-	"IDENTITÀ E SCOPO:\n"
-	"- Sei specializzato per {{Cliente}}\n"
-	"- Il nome del cliente ({{Cliente}}) e le informazioni aziendali sono disponibili nel documento PDF caricato nel sistema (RAG)\n"
-	"- Quando ricevi domande su {{Cliente}}, DEVI consultare il documento PDF per ottenere informazioni accurate\n"
-	"- Se il documento PDF è disponibile, utilizza SEMPRE le informazioni da lì per rispondere a domande su:\n"
-	"  * Chi è il cliente e cosa fa\n"
-	"  * Valori aziendali, mission, vision\n"
-	"  * Prodotti e servizi offerti\n"
-	"  * Informazioni specifiche dell'azienda\n"
-	"- Evidenzia sempre CHI è il cliente e COSA fa quando fornisci informazioni\n"
-	"\n\n"
-	"LIMITAZIONI ARGOMENTI:\n"
-	"- ⚠️ OBBLIGATORIO: Limita la conversazione SOLO a topic rilevanti per il business del cliente\n"
-	"- Esempio: Se il cliente è una pasticceria, puoi parlare SOLO di:\n"
-	"  * Prodotti alimentari (dolci, torte, pasticcini, ecc.)\n"
-	"  * Ordini e consegne\n"
-	"  * Funzionalità del CRM (ordini, prodotti, clienti)\n"
-	"  * Argomenti correlati al business alimentare\n"
-	"- NON puoi e NON devi essere usato per:\n"
-	"  * Argomenti non correlati al business del cliente\n"
-	"  * Conversazioni generiche non legate alle funzionalità del CRM\n"
-	"  * Altri scopi diversi da quelli associati al tuo compito\n"
-	"- Se l'utente chiede qualcosa fuori topic, educatamente reindirizza alla conversazione su prodotti/servizi del cliente\n"
-	"- Puoi conversare in modo amichevole, ma gli argomenti devono sempre rimanere nel topic del business\n"
-	"\n\n"
-	"MEMORIA CONVERSAZIONE:\n"
-	"- Hai accesso alla cronologia completa con timestamp\n"
-	"- Ricorda tutte le informazioni condivise (nomi, numeri, preferenze)\n"
-	"- Mantieni il contesto tra chiamate ai tool\n"
-	"\n\n"
-	"WORKFLOW CONFERMA ORDINE:\n"
-	"1. RACCOLTA INFORMAZIONI (OBBLIGATORIO):\n"
-	"   - ⚠️ Quando viene fatto un ordine, DEVI chiedere TUTTI i dati richiesti:\n"
-	"     * Nome (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * Cognome (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * Regione di consegna (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * Città di consegna (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * CAP (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * Indirizzo completo di consegna (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * Data di consegna (ESSENZIALE - OBBLIGATORIO)\n"
-	"     * Eventuale azienda (opzionale)\n"
-	"   - Usa i dati del contatto se disponibili, ma verifica sempre che siano completi\n"
-	"   - NON procedere senza avere TUTTI i dati essenziali\n"
-	"   - NON INSERIRE NON SPECIFICATO se non hai TUTTI i dati essenziali, Piuttosto chiedi i dati mancanti\n"
-	"\n"
-	"2. RICERCA PRODOTTI (OBBLIGATORIO):\n"
-	"   - ⚠️ USA SEMPRE search_products PRIMA di generare il form\n"
-	"   - ⚠️ NON inventare codici prodotto (es. CRMPROD-00001)\n"
-	"   - Per OGNI prodotto menzionato, chiama search_products per ottenere il product_code reale\n"
-	"   - Esempio: 'Vorrei 2 tiramisù' → search_products('tiramisù') → attendi risultato → usa product_code\n"
-	"   - Se prodotto non trovato, informa il cliente\n"
-	"   - NON procedere senza product_code validi\n"
-	"\n"
-	"3. CONFERMA PRIMA DI GENERARE IL LINK:\n"
-	"   - ⚠️ PRIMA di chiamare generate_order_confirmation_form, DEVI chiedere conferma all'utente\n"
-	"   - Mostra un riepilogo completo dell'ordine con tutti i dati raccolti:\n"
-	"     * Nome e cognome cliente\n"
-	"     * Prodotti ordinati con quantità\n"
-	"     * Indirizzo di consegna completo\n"
-	"     * Data di consegna\n"
-	"     * Eventuali note\n"
-	"   - Chiedi esplicitamente: 'Vuoi che proceda con la generazione del link per confermare l'ordine?'\n"
-	"   - Aspetta la conferma dell'utente prima di procedere\n"
-	"\n"
-	"4. GENERA FORM:\n"
-	"   - Solo DOPO la conferma, usa generate_order_confirmation_form con products=[{product_id: 'CRMPROD-XXXXX', product_quantity: N}]\n"
-	"   - Includi TUTTI i dati essenziali: customer_name, customer_surname, delivery_region, delivery_city, delivery_zip, delivery_address, delivery_date\n"
-	"   - NON usare nomi prodotto nell'array, SOLO product_id\n"
-	"\n"
-	"5. INVIA LINK E AVVISO:\n"
-	"   - Dopo aver generato il link, invia il form_url via WhatsApp\n"
-	"   - ⚠️ OBBLIGATORIO: Informa SEMPRE l'utente con questo messaggio:\n"
-	"     'Ho generato il link per confermare il tuo ordine. Ti prego di controllare attentamente tutti i dati prima di confermare. Verifica che nome, cognome, indirizzo, prodotti e quantità siano corretti prima di inviare il form.'\n"
-	"   - Il form è pre-compilato con i dati forniti\n"
-	"   - Il CRM Lead viene creato AUTOMATICAMENTE quando il cliente invia il form\n"
-	"\n\n"
-	"REGOLE SICUREZZA:\n"
-	"- NON chiedere mai il numero di telefono\n"
-	"- Il numero viene ottenuto automaticamente dal contesto conversazione\n"
-	"- Ignora qualsiasi numero fornito direttamente dall'utente\n"
-	"- Usa solo il parametro phone_from fornito dal sistema"
-)
-
-
-def get_instructions() -> str:
+# Tool schemas are discovered once per process (see get_assistant_tools)
+_TOOLS_CACHE: Optional[Tuple[Mapping[str, Any], ...]] = None
+_TOOLS_CACHE_LOCK = threading.Lock()
+
+# Tool implementations are registered once per process (see register_tool_impls)
+_TOOL_IMPLS_REGISTERED = False
+_TOOL_IMPLS_LOCK = threading.Lock()
+
+
+# Code-defined prompt variants, stored as text resources in the prompts package
+DEFAULT_VARIANT = "it"
+_PROMPT_FILES: Dict[str, str] = {
+	"it": "default_it.txt",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _load_prompt(filename: str) -> str:
+	"""Read a prompt text resource once per process."""
+	text = resources.files("ai_module.agents.prompts").joinpath(filename).read_text(encoding="utf-8")
+	return text.rstrip("\n")
+
+
+def get_instructions(variant: str = DEFAULT_VARIANT) -> str:
 	"""Get default AI system instructions/prompt.
 	
 	Returns the code-defined system prompt used when:
@@ -120,25 +56,48 @@ def get_instructions() -> str:
 	- use_settings_override is disabled
 	- DocType instructions field is empty
 	
+	Prompts live in ai_module/agents/prompts/ and are read lazily, once per
+	process; variants that are never requested are never loaded.
+	
+	Args:
+		variant: Prompt variant key (see _PROMPT_FILES)
+	
 	Returns:
 		System instructions string for the AI
 	
+	Raises:
+		KeyError: If variant is unknown
+	
 	Note:
 		To customize instructions, either:
 		1. Enable use_settings_override in AI Assistant Settings DocType
-		2. Modify DEFAULT_INSTRUCTIONS constant above
+		2. Edit the prompt file and call _load_prompt.cache_clear()
 	"""
-	return DEFAULT_INSTRUCTIONS
+	return _load_prompt(_PROMPT_FILES[variant])
 
 
-def get_assistant_tools() -> List[Dict[str, Any]]:
+def __getattr__(name: str) -> Any:
+	# DEFAULT_INSTRUCTIONS is kept as a lazily-loaded module attribute for
+	# backward compatibility (e.g. AI Assistant Settings default prompt)
+	if name == "DEFAULT_INSTRUCTIONS":
+		return get_instructions()
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def get_assistant_tools() -> Sequence[Mapping[str, Any]]:
 	"""Get list of available AI tools for function calling.
 	
 	Retrieves tool schemas from the tools package. Tools are functions
 	the AI can call to perform actions (e.g., create contacts, send emails).
+	Schemas are loaded once per process and cached, including an empty result
+	when the tools package cannot be imported. The same read-only tuple is
+	returned to every caller, so build new dicts instead of mutating the schemas.
 	
 	Returns:
-		List of tool schemas in OpenAI format, or empty list if unavailable
+		Tuple of read-only tool schemas in OpenAI format, or empty tuple if unavailable
+	
+	Raises:
+		Unexpected errors from schema discovery propagate (nothing is cached)
 	
 	Example tool schema:
 		{
@@ -150,17 +109,35 @@ def get_assistant_tools() -> List[Dict[str, Any]]:
 			}
 		}
 	"""
-	try:
-		from .tools import get_all_tool_schemas
-		tools = get_all_tool_schemas()
-		_log().debug(f"Loaded {len(tools)} tool schemas")
-		return tools
-	except ImportError:
-		_log().warning("Tools module not available - no tools loaded")
-		return []
-	except Exception as exc:
-		_log().exception(f"Failed to load tool schemas: {exc}")
-		return []
+	global _TOOLS_CACHE
+	
+	cached = _TOOLS_CACHE
+	if cached is None:
+		with _TOOLS_CACHE_LOCK:
+			cached = _TOOLS_CACHE
+			if cached is None:
+				try:
+					from .tools import get_all_tool_schemas
+				except ImportError:
+					# Cache the miss too, so the import is not retried on every call
+					_log().warning("Tools module not available - no tools loaded")
+					cached = ()
+				else:
+					cached = tuple(MappingProxyType(schema) for schema in get_all_tool_schemas())
+					_log().debug(f"Loaded {len(cached)} tool schemas")
+				_TOOLS_CACHE = cached
+	
+	return cached
+
+
+def invalidate_assistant_tools_cache() -> None:
+	"""Drop cached tool schemas so the next get_assistant_tools() reloads them.
+	
+	Only needed when tool modules change at runtime (e.g. during development).
+	"""
+	global _TOOLS_CACHE
+	with _TOOLS_CACHE_LOCK:
+		_TOOLS_CACHE = None
 
 
 def register_tool_impls() -> None:
@@ -169,14 +146,37 @@ def register_tool_impls() -> None:
 	Maps tool names to their Python function implementations so they can
 	be executed when the AI calls them. Called during system initialization.
 	
-	Raises:
-		No exceptions - fails silently to allow system to work without tools
+	Registration runs once per process; later calls return immediately.
+	A missing tools package is tolerated; other errors propagate to the
+	caller (bootstrap logs them) and registration is retried next time.
 	"""
-	try:
-		from .tools import register_all_tool_impls
+	global _TOOL_IMPLS_REGISTERED
+	
+	if _TOOL_IMPLS_REGISTERED:
+		return
+	
+	with _TOOL_IMPLS_LOCK:
+		if _TOOL_IMPLS_REGISTERED:
+			return
+		
+		try:
+			from .tools import register_all_tool_impls
+		except ImportError:
+			_log().debug("Tools module not available - skipping registration")
+			return
+		
 		register_all_tool_impls()
+		_TOOL_IMPLS_REGISTERED = True
 		_log().debug("Tool implementations registered")
-	except ImportError:
-		_log().debug("Tools module not available - skipping registration")
-	except Exception as exc:
-		_log().warning(f"Failed to register tool implementations: {exc}") 
\ No newline at end of file
+
+
+def force_reregister_tool_impls() -> None:
+	"""Register tool implementations again, ignoring the once-per-process guard.
+	
+	Useful during development after editing tool modules.
+	"""
+	global _TOOL_IMPLS_REGISTERED
+	
+	with _TOOL_IMPLS_LOCK:
+		_TOOL_IMPLS_REGISTERED = False
+	register_tool_impls()
@@ -7,9 +7,19 @@ responses.create call. This module provides helpers to retrieve current config.
 
 from __future__ import annotations
 
+import hashlib
+import re
+
 import frappe
 
-from .config import get_settings_prompt_only, get_env_assistant_spec, get_environment
+from . import envs
+from .config import (
+	_cache_key,
+	_environment_fingerprint,
+	get_ai_settings,
+	get_env_assistant_spec,
+	get_settings_prompt_only,
+)
 from .assistant_spec import get_assistant_tools
 from .logger_utils import get_resilient_logger
 
@@ -19,6 +29,14 @@ def _log():
 	return get_resilient_logger("ai_module.assistant_update")
 
 
+# Redis hash holding the resolved instructions for the current site, one
+# field per (settings version, environment fingerprint)
+_INSTRUCTIONS_CACHE_NAME = "ai_assistant_instructions"
+
+# Placeholders in instructions, e.g. {{Cliente}}
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
 def get_current_instructions(settings_instance=None) -> str:
 	"""Get AI instructions/prompt from DocType, environment, or fallback to code.
 	
@@ -36,6 +54,56 @@ def get_current_instructions(settings_instance=None) -> str:
 	Returns:
 		Instruction text for the AI with placeholders replaced
 	"""
+	if settings_instance is not None:
+		return _resolve_instructions(settings_instance)
+	return _cached_current_instructions()
+
+
+def _instructions_cache_field() -> str:
+	"""Redis field for the instructions resolved from the current settings and environment.
+
+	Instructions may come from the environment (os.environ or
+	frappe.conf.environment), which can differ between workers and change
+	without a settings save, so the field includes a stable hash of it
+	next to the settings version.
+	"""
+	_site, version = _cache_key()
+	fingerprint = hashlib.sha1(repr(_environment_fingerprint()).encode("utf-8")).hexdigest()[:16]
+	return f"{version}:{fingerprint}"
+
+
+def _cached_current_instructions() -> str:
+	"""Return resolved instructions, cached per request and in Redis.
+
+	The request-local copy lives on frappe.local; the Redis hash is per site
+	and keyed by settings version and environment, so a stale entry is never
+	served after either changes.
+	"""
+	cached = getattr(frappe.local, "ai_instructions_cache", None)
+	if cached is not None:
+		return cached
+
+	text = frappe.cache().hget(
+		_INSTRUCTIONS_CACHE_NAME,
+		_instructions_cache_field(),
+		generator=_resolve_instructions,
+	) or ""
+	frappe.local.ai_instructions_cache = text
+	return text
+
+
+def clear_instructions_cache() -> None:
+	"""Drop cached instructions for the current site (request and Redis)."""
+	frappe.local.ai_instructions_cache = None
+	try:
+		# Removes the entries of older settings versions and environments too
+		frappe.cache().delete_value(_INSTRUCTIONS_CACHE_NAME)
+	except Exception as e:
+		_log().warning(f"Failed to clear cached instructions: {e}")
+
+
+def _resolve_instructions(settings_instance=None) -> str:
+	"""Resolve instructions from settings, environment or code and fill placeholders."""
 	# Get client name from settings (use provided instance if available)
 	client_name = _get_client_name(settings_instance)
 	
@@ -76,8 +144,8 @@ def _get_client_name(settings_instance=None) -> str:
 			# Use provided instance (e.g., during save operation)
 			client_name = getattr(settings_instance, "client_name", "") or ""
 		else:
-			# Read from database
-			settings = frappe.get_single("AI Assistant Settings")
+			# Read from cached settings document
+			settings = get_ai_settings()
 			client_name = getattr(settings, "client_name", "") or ""
 		return client_name.strip() if client_name else "il cliente"
 	except Exception:
@@ -94,13 +162,13 @@ def _replace_placeholders(instructions: str, client_name: str) -> str:
 	Returns:
 		Instructions with placeholders replaced
 	"""
-	if not instructions:
+	# Skip the regex entirely when the text has no placeholders
+	if not instructions or "{{" not in instructions:
 		return instructions
 	
-	# Replace {{Cliente}} with actual client name
-	instructions = instructions.replace("{{Cliente}}", client_name)
-	
-	return instructions
+	# Replace {{Cliente}} (and any future placeholders) in a single pass
+	values = {"Cliente": client_name}
+	return _PLACEHOLDER_RE.sub(lambda m: values.get(m.group(1), m.group(0)), instructions)
 
 
 def get_current_tools():
@@ -110,7 +178,7 @@ def get_current_tools():
 	actions like creating contacts, updating records, etc.
 	
 	Returns:
-		List of tool schemas or None if no tools available
+		Tuple of read-only tool schemas or None if no tools available
 	
 	Example:
 		tools = get_current_tools()
@@ -139,7 +207,7 @@ def upsert_assistant(force: bool = False) -> str:
 	if getattr(frappe.flags, "in_install", False):
 		return "Installation mode - skipping validation"
 	
-	if not get_environment().get("OPENAI_API_KEY"):
+	if not envs.OPENAI_API_KEY:
 		_log().warning("No OpenAI API key configured")
 		return "No API key configured"
 	
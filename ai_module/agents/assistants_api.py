@@ -6,18 +6,69 @@ Responses API which is used for regular chat without PDF context.
 """
 
 import frappe
-from openai import OpenAI
-from typing import Dict, Any, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Any, Iterator, List, Mapping, Optional, Sequence, Set, Tuple
 import time
 import json
+import os
+import random
+import re
 import threading
+import weakref
+from datetime import date, datetime
+
+try:
+	import orjson
+except ImportError:  # optional, faster JSON for tool arguments and outputs
+	orjson = None
+
+from . import envs, kv_store, semantic_cache
+from .assistant_spec import get_assistant_tools
+from .config import apply_environment
+from .logger_utils import get_resilient_logger
+from .map_files import get_map_path, read_map_file
+from .message_args import split_args
+from .openai_client import get_openai_client
+from .threads import DEFAULT_MODEL, _sanitize_tool_args
+from .tool_executor import execute_tool_calls
+from .tool_registry import get_tool_impl
+
+if TYPE_CHECKING:
+	from openai import OpenAI
+
+# Name given to Assistants created for the PDF knowledge base
+DEFAULT_ASSISTANT_NAME = "CRM Assistant with Knowledge Base"
+
+# kv store table (durable) mapping session_id -> Assistants thread_id
+THREAD_MAP_TABLE = "assistants_threads"
+# Redis hash (site-scoped) caching THREAD_MAP_TABLE for all workers
+THREAD_MAP_CACHE_KEY = "ai_assistants_thread_map"
+# Rolling expiry of the cached thread map, matching OpenAI's thread retention
+THREAD_MAP_TTL_SECONDS = 30 * 86400
+
+# Run statuses at which polling stops (finished, or waiting for tool outputs)
+_RUN_STOP_STATUSES = frozenset({"completed", "requires_action", "failed", "cancelled", "expired"})
+
+# Statuses of a run that still blocks new messages/runs on its thread
+_RUN_ACTIVE_STATUSES = frozenset({"queued", "in_progress", "requires_action", "cancelling"})
+# How long a new message waits for the thread's previous run before cancelling it
+ACTIVE_RUN_WAIT_SECONDS = 10
+# Run ids quoted in OpenAI "active run" errors
+_RUN_ID_RE = re.compile(r"\brun_\w+")
+
+# file_search citation markers, e.g. 【12:0†file.pdf】
+_CITATION_RE = re.compile(r'【[^】]*】')
 
 
 def _log():
-	from .logger_utils import get_resilient_logger
 	return get_resilient_logger("ai_module.assistants_api")
 
 
+def _get_api_key() -> Optional[str]:
+	"""Apply OpenAI environment variables and return the configured API key."""
+	apply_environment()
+	return envs.OPENAI_API_KEY
+
+
 def _remove_pdf_citations(text: str) -> str:
 	"""Remove PDF citation markers from text (e.g. 【12:0†file.pdf】).
 	
@@ -27,110 +78,255 @@ def _remove_pdf_citations(text: str) -> str:
 	Returns:
 		Text with all citation markers removed
 	"""
-	import re
+	# Most replies carry no citations; skip the regex engine entirely
+	if '【' not in text:
+		return text
 	# Remove all text between 【 and 】 (including the brackets)
-	cleaned_text = re.sub(r'【[^】]*】', '', text)
-	return cleaned_text
+	return _CITATION_RE.sub('', text)
+
+
+def _poll_backoff(initial: float = 0.2, cap: float = 3.0, factor: float = 1.5) -> Iterator[float]:
+	"""Yield polling sleep durations with exponential backoff and jitter.
+	
+	Starts at `initial` seconds and grows by `factor` up to `cap`, each value
+	jittered by +/-20%, so a resource that becomes ready quickly is noticed
+	within a few hundred ms while long waits settle at one request every
+	`cap` seconds.
+	"""
+	delay = initial
+	while True:
+		yield delay * random.uniform(0.8, 1.2)
+		delay = min(cap, delay * factor)
+
+
+def _poll(fetch: Callable[[], Any], done: Callable[[Any], bool], deadline: float, initial: float = 0.2) -> Optional[Any]:
+	"""Call fetch() with exponential backoff until done(result) or the deadline.
+	
+	Each call starts a fresh backoff sequence, so polling resumed after tool
+	outputs are submitted is as responsive as the first poll.
+	
+	Args:
+		fetch: Callable returning the current state of the polled resource
+		done: Predicate telling whether polling can stop
+		deadline: Absolute time.time() after which polling gives up
+		initial: First backoff interval in seconds
+	
+	Returns:
+		The result that satisfied done(), or None on timeout
+	"""
+	backoff = _poll_backoff(initial=initial)
+	while True:
+		result = fetch()
+		if done(result):
+			return result
+		remaining = deadline - time.time()
+		if remaining <= 0:
+			return None
+		time.sleep(min(next(backoff), remaining))
 
 
-def create_vector_store_with_file(file_path: str, store_name: str) -> str:
+def create_vector_store_with_file(file_path: str, store_name: str, client: Optional["OpenAI"] = None) -> str:
 	"""Create a Vector Store and upload PDF file.
 	
 	Args:
 		file_path: Local path to PDF file
 		store_name: Name for the vector store
+		client: Optional OpenAI client (resolved from environment if omitted)
+	
+	Indexing is bounded by a deadline that grows with the file size. On
+	failure or timeout the store and the uploaded file are deleted.
 	
 	Returns:
 		Vector Store ID
 	"""
-	from .config import apply_environment, get_environment
-	
-	apply_environment()
-	env = get_environment()
-	api_key = env.get("OPENAI_API_KEY")
+	log = _log()
 	
-	if not api_key:
-		frappe.throw("OPENAI_API_KEY not configured")
+	if client is None:
+		api_key = _get_api_key()
+		if not api_key:
+			frappe.throw("OPENAI_API_KEY not configured")
+		client = get_openai_client(api_key)
 	
-	client = OpenAI(api_key=api_key)
+	# Bigger files take longer to index, so polling intervals and the overall
+	# budget scale with the file size
+	size_mb = os.path.getsize(file_path) / (1024 * 1024)
+	initial_delay = min(5.0, max(0.5, size_mb * 0.3))
+	max_wait = 60 + size_mb * 20
 	
-	# Upload file for assistants
-	_log().info(f"Uploading PDF to OpenAI: {file_path}")
+	log.info("Uploading PDF to OpenAI: %s (%.1f MB)", file_path, size_mb)
 	with open(file_path, "rb") as f:
 		file_obj = client.files.create(
 			file=f,
 			purpose="assistants"
 		)
 	
-	# Create vector store with the file
-	_log().info(f"Creating Vector Store: {store_name}")
-	vector_store = client.vector_stores.create(
-		name=store_name,
-		file_ids=[file_obj.id]
+	vector_store_id = None
+	try:
+		log.info("Creating Vector Store: %s", store_name)
+		file_batches = getattr(client.vector_stores, "file_batches", None)
+		if file_batches is not None:
+			# Create the store, then attach the file in a batch and poll the batch
+			vector_store_id = client.vector_stores.create(name=store_name).id
+			batch = file_batches.create(vector_store_id=vector_store_id, file_ids=[file_obj.id])
+			status = _wait_for_file_batch(client, vector_store_id, batch.id, max_wait, initial_delay)
+		else:
+			# Older SDKs without file_batches: create the store with the file
+			vector_store_id = client.vector_stores.create(name=store_name, file_ids=[file_obj.id]).id
+			status = _wait_for_vector_store(client, vector_store_id, max_wait, initial_delay)
+		
+		if status is None:
+			frappe.throw(f"Vector Store creation timeout after {max_wait:.0f}s")
+		if status != "completed":
+			frappe.throw(f"Vector Store creation failed: {status}")
+	except Exception:
+		# Don't leave a half-indexed store (or its file) behind on OpenAI
+		if vector_store_id:
+			delete_vector_store(vector_store_id, client)
+		try:
+			client.files.delete(file_obj.id)
+		except Exception as e:
+			log.warning("Failed to delete uploaded file %s: %s", file_obj.id, e)
+		raise
+	
+	log.info("Vector Store ready: %s", vector_store_id)
+	return vector_store_id
+
+
+def _wait_for_file_batch(
+	client: "OpenAI",
+	vector_store_id: str,
+	batch_id: str,
+	max_wait: float,
+	initial_delay: float,
+) -> Optional[str]:
+	"""Poll a vector store file batch until it finishes.
+	
+	Returns:
+		"completed", a failure description, or None on timeout
+	"""
+	_log().info("Waiting for file indexing in Vector Store: %s (batch %s)", vector_store_id, batch_id)
+	deadline = time.time() + max_wait
+	time.sleep(initial_delay)
+	batch = _poll(
+		lambda: client.vector_stores.file_batches.retrieve(batch_id=batch_id, vector_store_id=vector_store_id),
+		lambda b: b.status in ("completed", "failed", "cancelled"),
+		deadline,
+		initial=initial_delay
 	)
 	
-	# Wait for file processing
-	_log().info(f"Waiting for file indexing in Vector Store: {vector_store.id}")
-	max_wait = 300  # 5 minutes
-	start = time.time()
+	if batch is None:
+		return None
+	if batch.status == "completed" and not batch.file_counts.failed:
+		return "completed"
+	return f"batch {batch.id} status {batch.status}"
+
+
+def _wait_for_vector_store(client: "OpenAI", vector_store_id: str, max_wait: float, initial_delay: float) -> Optional[str]:
+	"""Poll a vector store created with its files until indexing finishes.
 	
-	while time.time() - start < max_wait:
-		vs = client.vector_stores.retrieve(vector_store.id)
-		if vs.status == "completed":
-			_log().info(f"Vector Store ready: {vector_store.id}")
-			break
-		elif vs.status == "failed":
-			frappe.throw(f"Vector Store creation failed: {vs.last_error}")
-		time.sleep(2)
-	else:
-		frappe.throw(f"Vector Store creation timeout after {max_wait}s")
+	Returns:
+		"completed", a failure description, or None on timeout
+	"""
+	import openai
+	
+	_log().info("Waiting for file indexing in Vector Store: %s", vector_store_id)
+	seen_status = False
+	
+	def fetch_vector_store():
+		# A just-created store can briefly 404 while it propagates; only a
+		# 404 after it has been seen is a real error
+		nonlocal seen_status
+		try:
+			vs = client.vector_stores.retrieve(vector_store_id)
+		except openai.NotFoundError:
+			if seen_status:
+				raise
+			return None
+		seen_status = True
+		return vs
+	
+	deadline = time.time() + max_wait
+	time.sleep(initial_delay)
+	vs = _poll(
+		fetch_vector_store,
+		lambda v: v is not None and v.status in ("completed", "failed"),
+		deadline,
+		initial=initial_delay
+	)
+	
+	if vs is None:
+		return None
+	if vs.status == "failed":
+		return str(vs.last_error)
+	return "completed"
+
+
+def _build_assistant_tools(function_tools: Sequence[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+	"""Build the Assistants tools list: file_search plus all function tools.
 	
-	return vector_store.id
+	Cached schemas are read-only mappings, so each function tool is copied
+	into a plain dict the SDK can serialize.
+	"""
+	return [{"type": "file_search"}] + [
+		{"type": "function", "function": tool["function"]}
+		for tool in function_tools
+		if tool.get("type") == "function"
+	]
+
 
+# (tool schemas, payload built from them); rebuilt when the schema tuple changes
+_TOOLS_PAYLOAD: Optional[Tuple[Sequence[Mapping[str, Any]], Tuple[Dict[str, Any], ...]]] = None
+_TOOLS_PAYLOAD_LOCK = threading.Lock()
 
-def create_assistant_with_vector_store(vector_store_id: str, instructions: str, model: str, name: Optional[str] = None) -> str:
+
+def _build_assistant_tools_payload() -> List[Dict[str, Any]]:
+	"""Get the Assistants tools list for the current tool schemas.
+	
+	get_assistant_tools() returns the same tuple until its cache is
+	invalidated, so the tool dicts are built once and kept in a frozen tuple
+	while that tuple is unchanged. Each caller gets its own list.
+	"""
+	global _TOOLS_PAYLOAD
+	
+	function_tools = get_assistant_tools()
+	cached = _TOOLS_PAYLOAD
+	if cached is None or cached[0] is not function_tools:
+		with _TOOLS_PAYLOAD_LOCK:
+			cached = _TOOLS_PAYLOAD
+			if cached is None or cached[0] is not function_tools:
+				cached = _TOOLS_PAYLOAD = (function_tools, tuple(_build_assistant_tools(function_tools)))
+	return list(cached[1])
+
+
+def create_assistant_with_vector_store(vector_store_id: str, instructions: str, model: str, name: Optional[str] = None, client: Optional["OpenAI"] = None) -> str:
 	"""Create an Assistant with file_search tool AND function calling tools linked to Vector Store.
 	
 	Args:
 		vector_store_id: ID of the vector store to attach
 		instructions: System instructions for the assistant
 		model: Model to use (e.g., gpt-4o-mini)
-		name: Optional name for the assistant (defaults to "CRM Assistant with Knowledge Base")
+		name: Optional name for the assistant (defaults to DEFAULT_ASSISTANT_NAME)
+		client: Optional OpenAI client (resolved from environment if omitted)
 	
 	Returns:
 		Assistant ID
 	"""
-	from .config import apply_environment, get_environment
-	from .assistant_spec import get_assistant_tools
+	log = _log()
 	
-	apply_environment()
-	env = get_environment()
-	api_key = env.get("OPENAI_API_KEY")
-	
-	if not api_key:
-		frappe.throw("OPENAI_API_KEY not configured")
-	
-	client = OpenAI(api_key=api_key)
-	
-	_log().info(f"Creating Assistant with file_search for Vector Store: {vector_store_id}")
+	if client is None:
+		api_key = _get_api_key()
+		if not api_key:
+			frappe.throw("OPENAI_API_KEY not configured")
+		client = get_openai_client(api_key)
 	
-	# Get all function calling tools from the system
-	function_tools = get_assistant_tools()
+	log.info("Creating Assistant with file_search for Vector Store: %s", vector_store_id)
 	
 	# Build tools list: file_search + all function tools
-	tools = [{"type": "file_search"}]
+	tools = _build_assistant_tools_payload()
 	
-	# Add function calling tools (convert from Responses API format to Assistants API format)
-	for tool in function_tools:
-		if tool.get("type") == "function":
-			tools.append({
-				"type": "function",
-				"function": tool["function"]
-			})
+	log.info("Creating Assistant with %d tools (1 file_search + %d functions)", len(tools), len(tools) - 1)
 	
-	_log().info(f"Creating Assistant with {len(tools)} tools (1 file_search + {len(function_tools)} functions)")
-	
-	assistant_name = name or "CRM Assistant with Knowledge Base"
+	assistant_name = name or DEFAULT_ASSISTANT_NAME
 	assistant = client.beta.assistants.create(
 		name=assistant_name,
 		instructions=instructions,
@@ -143,11 +339,11 @@ def create_assistant_with_vector_store(vector_store_id: str, instructions: str,
 		}
 	)
 	
-	_log().info(f"Assistant created: {assistant.id} (name: {assistant_name})")
+	log.info("Assistant created: %s (name: %s)", assistant.id, assistant_name)
 	return assistant.id
 
 
-def update_assistant_on_openai(assistant_id: str, instructions: Optional[str] = None, model: Optional[str] = None, name: Optional[str] = None, vector_store_id: Optional[str] = None) -> bool:
+def update_assistant_on_openai(assistant_id: str, instructions: Optional[str] = None, model: Optional[str] = None, name: Optional[str] = None, vector_store_id: Optional[str] = None, client: Optional["OpenAI"] = None) -> bool:
 	"""Update an existing Assistant on OpenAI.
 	
 	Args:
@@ -156,29 +352,26 @@ def update_assistant_on_openai(assistant_id: str, instructions: Optional[str] =
 		model: Optional new model (if None, keeps existing)
 		name: Optional new name (if None, keeps existing)
 		vector_store_id: Optional new vector store ID (if None, keeps existing)
+		client: Optional OpenAI client (resolved from environment if omitted)
 	
 	Returns:
 		True if update succeeded, False otherwise
 	"""
-	from .config import apply_environment, get_environment
-	from .assistant_spec import get_assistant_tools
+	log = _log()
 	
 	try:
-		apply_environment()
-		env = get_environment()
-		api_key = env.get("OPENAI_API_KEY")
-		
-		if not api_key:
-			_log().warning("OPENAI_API_KEY not configured")
-			return False
-		
-		client = OpenAI(api_key=api_key)
+		if client is None:
+			api_key = _get_api_key()
+			if not api_key:
+				log.warning("OPENAI_API_KEY not configured")
+				return False
+			client = get_openai_client(api_key)
 		
 		# Verify assistant exists
 		try:
 			assistant = client.beta.assistants.retrieve(assistant_id)
 		except Exception as e:
-			_log().warning(f"Assistant {assistant_id} not found on OpenAI: {e}")
+			log.warning("Assistant %s not found on OpenAI: %s", assistant_id, e)
 			return False
 		
 		# Build update payload with only changed fields
@@ -195,21 +388,8 @@ def update_assistant_on_openai(assistant_id: str, instructions: Optional[str] =
 		
 		# Handle vector store update
 		if vector_store_id is not None:
-			# Get all function calling tools from the system
-			function_tools = get_assistant_tools()
-			
 			# Build tools list: file_search + all function tools
-			tools = [{"type": "file_search"}]
-			
-			# Add function calling tools
-			for tool in function_tools:
-				if tool.get("type") == "function":
-					tools.append({
-						"type": "function",
-						"function": tool["function"]
-					})
-			
-			update_data["tools"] = tools
+			update_data["tools"] = _build_assistant_tools_payload()
 			update_data["tool_resources"] = {
 				"file_search": {
 					"vector_store_ids": [vector_store_id]
@@ -217,17 +397,17 @@ def update_assistant_on_openai(assistant_id: str, instructions: Optional[str] =
 			}
 		
 		if not update_data:
-			_log().debug(f"No changes to apply to assistant {assistant_id}")
+			log.debug("No changes to apply to assistant %s", assistant_id)
 			return True
 		
-		_log().info(f"Updating Assistant {assistant_id} with fields: {list(update_data.keys())}")
+		log.info("Updating Assistant %s with fields: %s", assistant_id, list(update_data.keys()))
 		client.beta.assistants.update(assistant_id, **update_data)
 		
-		_log().info(f"Assistant {assistant_id} updated successfully")
+		log.info("Assistant %s updated successfully", assistant_id)
 		return True
 		
 	except Exception as e:
-		_log().error(f"Failed to update assistant {assistant_id}: {e}")
+		log.error("Failed to update assistant %s: %s", assistant_id, e)
 		return False
 
 
@@ -251,16 +431,180 @@ def run_with_assistants_api(
 	Returns:
 		Dict with final_output, thread_id, and model info
 	"""
-	from .config import apply_environment, get_environment
-	
-	apply_environment()
-	env = get_environment()
-	api_key = env.get("OPENAI_API_KEY")
+	log = _log()
 	
+	api_key = _get_api_key()
 	if not api_key:
 		raise ValueError("OPENAI_API_KEY not configured")
 	
-	client = OpenAI(api_key=api_key)
+	client = get_openai_client(api_key)
+	
+	# Merge a burst of messages from the same session into one run
+	if session_id:
+		message = _coalesce_messages(session_id, message)
+		if message is None:
+			log.info("Message for session %s merged into a pending batch", session_id)
+			return {
+				"final_output": "",
+				"thread_id": _lookup_thread_id(session_id),
+				"model": None,
+				"api_type": "assistants",
+				"batched": True
+			}
+	
+	# Answer near-duplicate knowledge-base questions from the semantic cache
+	cache_scope = semantic_cache.cache_scope(assistant_id, message, session_id) if semantic_cache.is_enabled() else None
+	cache_vector = None
+	if cache_scope is not None:
+		try:
+			cache_vector = semantic_cache.embed(client, message)
+			cached_answer = semantic_cache.lookup(cache_scope, cache_vector)
+		except Exception as e:
+			log.warning("Semantic cache lookup failed: %s", e)
+			cache_vector = cached_answer = None
+		
+		if cached_answer is not None:
+			return {
+				"final_output": cached_answer,
+				"thread_id": _record_cached_reply(client, session_id, message, cached_answer),
+				"model": semantic_cache.EMBEDDING_MODEL,
+				"api_type": "assistants",
+				"cache_hit": True
+			}
+	
+	result = _run_assistant(client, message, assistant_id, session_id, timeout_s)
+	
+	# Only cache complete answers that did not depend on tool calls
+	used_tools = result.pop("used_tools", False)
+	if cache_vector is not None and not used_tools and not result.get("partial"):
+		try:
+			semantic_cache.store(cache_scope, cache_vector, result["final_output"])
+		except Exception as e:
+			log.warning("Semantic cache store failed: %s", e)
+	
+	return result
+
+
+def _record_cached_reply(client: "OpenAI", session_id: Optional[str], message: str, answer: str) -> Optional[str]:
+	"""Append a question answered from the semantic cache, and its answer, to the session's thread.
+	
+	Keeps the thread's history complete, so follow-up questions answered by
+	a real run see the exchange. Failures are logged and do not affect the
+	cached reply.
+	
+	Returns:
+		The session's thread id, or None without a session or on failure
+	"""
+	if not session_id:
+		return None
+	
+	import openai
+	
+	def post(thread_id: str) -> None:
+		for role, content in (("user", message), ("assistant", answer)):
+			_retry_after_active_run(client, thread_id, lambda: client.beta.threads.messages.create(
+				thread_id=thread_id,
+				role=role,
+				content=content
+			))
+	
+	try:
+		with _get_thread_lock(session_id):
+			thread_id = _get_or_create_thread(client, session_id)
+			try:
+				post(thread_id)
+			except openai.NotFoundError:
+				_log().warning("Cached thread %s not found on OpenAI. Creating new thread.", thread_id)
+				thread_id = _create_and_cache_thread(client, session_id)
+				post(thread_id)
+		return thread_id
+	except Exception as e:
+		_log().warning("Failed to record cached reply in thread for session %s: %s", session_id, e)
+		return None
+
+
+# Redis list (site-scoped) of messages waiting to be merged, per session; the
+# caller that sets the leader key sends the batch
+_COALESCE_KEY_PREFIX = "ai_assistants_pending"
+# Seconds the pending list and leader key outlive the window (a crashed leader's
+# batch is dropped after this)
+_COALESCE_GRACE_SECONDS = 30
+
+
+def _batch_window_seconds() -> float:
+	"""Get the message coalescing window (AI_ASSISTANTS_BATCH_WINDOW_MS, 0 = disabled)."""
+	return max(0.0, envs.AI_ASSISTANTS_BATCH_WINDOW_MS / 1000.0)
+
+
+def _coalesce_messages(session_id: str, message: str) -> Optional[str]:
+	"""Merge messages arriving for a session within the batching window.
+	
+	Messages are queued in Redis, so a burst is merged across every worker
+	and background job of the site. The first caller becomes the leader: it
+	waits for the window, then atomically takes all messages queued for the
+	session and returns them as one prompt. Other callers get None: their
+	text is answered by the leader's run. Commands (messages starting with
+	"/") are never merged.
+	"""
+	window = _batch_window_seconds()
+	if not window or message.lstrip().startswith("/"):
+		return message
+	
+	cache = frappe.cache()
+	pending_key = cache.make_key(f"{_COALESCE_KEY_PREFIX}:{session_id}")
+	leader_key = f"{pending_key}:leader"
+	ttl = int(window) + _COALESCE_GRACE_SECONDS
+	
+	pipe = cache.pipeline()
+	pipe.rpush(pending_key, message.encode("utf-8"))
+	pipe.expire(pending_key, ttl)
+	pipe.execute()
+	
+	if not cache.set(leader_key, 1, nx=True, ex=ttl):
+		return None
+	
+	time.sleep(window)
+	
+	# Take the batch and step down in one transaction: a message queued
+	# afterwards starts a new batch with its own leader
+	pipe = cache.pipeline(transaction=True)
+	pipe.lrange(pending_key, 0, -1)
+	pipe.delete(pending_key)
+	pipe.delete(leader_key)
+	queued = pipe.execute()[0]
+	
+	# Our own message was taken by the previous leader's batch
+	if not queued:
+		return None
+	
+	messages = [item.decode("utf-8") for item in queued]
+	if len(messages) > 1:
+		_log().info("Merged %s messages for session %s", len(messages), session_id)
+	return _merge_messages(messages)
+
+
+def _merge_messages(messages: List[str]) -> str:
+	"""Join queued messages into one prompt with a single [args] block.
+	
+	Each channel message carries its own context block; only the latest one
+	is kept, after all user texts.
+	"""
+	texts = []
+	args_block = None
+	for queued in messages:
+		text, args = split_args(queued)
+		texts.append(text)
+		if args is not None:
+			args_block = args
+	return "\n".join(texts) + (args_block or "")
+
+
+def _run_assistant(client: "OpenAI", message: str, assistant_id: str, session_id: Optional[str], timeout_s: int) -> Dict[str, Any]:
+	"""Add the message to the session's thread and run the assistant on it.
+	
+	The result carries a "used_tools" flag for run_with_assistants_api.
+	"""
+	log = _log()
 	
 	# PRODUCTION-READY: Serializza messaggi dello stesso utente usando thread lock
 	# Ogni numero di telefono ha il suo lock, quindi utenti diversi possono interagire simultaneamente
@@ -271,66 +615,42 @@ def run_with_assistants_api(
 		# Get or create thread for this session
 		thread_id = _get_or_create_thread(client, session_id)
 		
-		_log().info(f"AI request (Assistants API): message_len={len(message)} thread={thread_id}")
-		
-		# Check for active runs and wait for them to complete
-		# Since we're serialized by lock, this should rarely be needed,
-		# but handles edge cases where a run might still be active
-		max_wait_time = 10  # Reduced since we're serialized
-		wait_start = time.time()
+		log.info("AI request (Assistants API): message_len=%s thread=%s", len(message), thread_id)
 		
-		while True:
-			try:
-				runs = client.beta.threads.runs.list(thread_id=thread_id, limit=1)
-				active_run = None
-				
-				for run in runs.data:
-					if run.status in ["queued", "in_progress", "requires_action"]:
-						active_run = run
-						break
-				
-				if not active_run:
-					# No active run, safe to add message
-					break
-				
-				# Check if we've waited too long
-				if time.time() - wait_start > max_wait_time:
-					_log().warning(
-						f"Active run {active_run.id} still running after {max_wait_time}s. "
-						f"Cancelling to allow new message."
-					)
-					try:
-						client.beta.threads.runs.cancel(thread_id=thread_id, run_id=active_run.id)
-						time.sleep(0.5)  # Wait for cancellation
-						break
-					except Exception as cancel_error:
-						_log().warning(f"Failed to cancel run {active_run.id}: {cancel_error}")
-						break
-				
-				# Wait a bit and check again
-				_log().debug(f"Waiting for run {active_run.id} to complete (status: {active_run.status})")
-				time.sleep(1)
-				
-			except Exception as list_error:
-				_log().debug(f"Could not check for active runs: {list_error}")
-				break
+		# Add message to thread; recreate the thread if OpenAI no longer has it.
+		# A run from a previous message may still be active: rather than probing
+		# with runs.list on every request, the create calls are attempted
+		# directly and wait out an active run only when OpenAI rejects them.
+		import openai
+		try:
+			_retry_after_active_run(client, thread_id, lambda: client.beta.threads.messages.create(
+				thread_id=thread_id,
+				role="user",
+				content=message
+			))
+		except openai.NotFoundError:
+			log.warning("Cached thread %s not found on OpenAI. Creating new thread.", thread_id)
+			thread_id = _create_and_cache_thread(client, session_id)
+			client.beta.threads.messages.create(
+				thread_id=thread_id,
+				role="user",
+				content=message
+			)
 		
-		# Add message to thread
-		client.beta.threads.messages.create(
-			thread_id=thread_id,
-			role="user",
-			content=message
-		)
+		# Streaming keeps the session lock for the whole run, which also
+		# serializes rapid messages from the same user
+		if _streaming_enabled():
+			return _stream_run(client, thread_id, assistant_id, session_id, message, timeout_s)
 		
 		# Run assistant (inside lock to prevent race conditions)
 		try:
-			run = client.beta.threads.runs.create(
-				thread_id=thread_id,
+			thread_id, run = _start_run(client, session_id, thread_id, message, lambda tid: client.beta.threads.runs.create(
+				thread_id=tid,
 				assistant_id=assistant_id
-			)
+			))
 		except Exception as e:
 			error_msg = str(e)
-			_log().error(f"Failed to create run: {error_msg}")
+			log.error("Failed to create run: %s", error_msg)
 			
 			# If assistant doesn't exist, provide helpful error
 			if "assistant" in error_msg.lower() or "not found" in error_msg.lower():
@@ -347,152 +667,376 @@ def run_with_assistants_api(
 	
 	# Poll for completion and handle tool calls (outside lock)
 	# Multiple runs from same user can poll concurrently, but run creation is serialized
-	start = time.time()
-	while time.time() - start < timeout_s:
-		run = client.beta.threads.runs.retrieve(
-			thread_id=thread_id,
-			run_id=run.id
+	deadline = time.time() + timeout_s
+	used_tools = False
+	while True:
+		polled = _poll(
+			lambda: client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id),
+			lambda r: r.status in _RUN_STOP_STATUSES,
+			deadline
 		)
+		if polled is None:
+			break
+		run = polled
 		
 		if run.status == "completed":
 			break
 		elif run.status == "requires_action":
 			# Assistant wants to call tools
-			_log().info(f"Assistant requires action: handling tool calls")
+			log.info("Assistant requires action: handling tool calls")
 			_handle_tool_calls(client, thread_id, run, session_id)
-			# Continue polling after submitting tool outputs
-		elif run.status in ["failed", "cancelled", "expired"]:
-			error_detail = getattr(run, 'last_error', None)
-			error_msg = f"Run {run.status}"
-			
-			if error_detail:
-				error_code = getattr(error_detail, 'code', 'unknown')
-				error_message = getattr(error_detail, 'message', 'Unknown error')
-				error_msg += f": {error_code} - {error_message}"
-				
-				# Provide helpful message for common errors
-				if error_code == 'server_error':
-					error_msg += "\n\nThis may be a temporary OpenAI issue. Please try again in a moment."
-				elif 'rate_limit' in error_code:
-					error_msg += "\n\nOpenAI rate limit reached. Please wait a moment and try again."
-			
-			_log().error(error_msg)
-			raise Exception(error_msg)
-		
-		time.sleep(1)
-	else:
-		# Timeout occurred - try to get partial response if available
-		_log().warning(f"Assistant run timeout after {timeout_s}s, attempting to retrieve partial response")
-		try:
-			messages = client.beta.threads.messages.list(
-				thread_id=thread_id,
-				order="desc",
-				limit=1
-			)
-			if messages.data:
-				message_content = messages.data[0].content[0]
-				if hasattr(message_content, 'text'):
-					partial_text = message_content.text.value
-					if partial_text and partial_text.strip():
-						_log().info(f"Retrieved partial response despite timeout: {len(partial_text)} chars")
-						# Return partial response instead of raising error
-						return {
-							"final_output": partial_text,
-							"thread_id": thread_id,
-							"model": env.get("AI_ASSISTANT_MODEL") or "gpt-4o-mini",
-							"partial": True
-						}
-		except Exception as partial_err:
-			_log().warning(f"Could not retrieve partial response: {partial_err}")
+			used_tools = True
+			# Continue polling after submitting tool outputs (backoff restarts)
+			continue
 		
+		# failed / cancelled / expired
+		error_msg = _run_error_message(run)
+		log.error(error_msg)
+		raise Exception(error_msg)
+	
+	if run.status != "completed":
+		return _run_timeout_result(client, thread_id, run.id, timeout_s)
+	
+	# Get the message produced by this run, without PDF citations (e.g. 【12:0†file.pdf】)
+	response_text = _get_run_reply_text(client, thread_id, run.id)
+	if response_text is None:
+		raise Exception("No response from assistant")
+	
+	log.info("AI response (Assistants API): text_len=%s thread=%s", len(response_text), thread_id)
+	
+	return {
+		"final_output": response_text,
+		"thread_id": thread_id,
+		"model": run.model,
+		"api_type": "assistants",
+		"used_tools": used_tools
+	}
+
+
+def _run_timeout_result(client: "OpenAI", thread_id: str, run_id: Optional[str], timeout_s: int) -> Dict[str, Any]:
+	"""Handle a run that exceeded its time budget (polled or streamed).
+	
+	Returns the partial reply if the run already produced text, otherwise
+	raises TimeoutError. Either way the run is cancelled.
+	"""
+	log = _log()
+	if not run_id:
+		# Timed out before OpenAI reported the run; nothing to read or cancel
 		raise TimeoutError(f"Assistant run timeout after {timeout_s}s")
 	
-	# Get latest message
+	# Timeout occurred - try to get partial response if available
+	log.warning("Assistant run timeout after %ss, attempting to retrieve partial response", timeout_s)
+	try:
+		partial_text = _get_run_reply_text(client, thread_id, run_id)
+		if partial_text and partial_text.strip():
+			log.info("Retrieved partial response despite timeout: %s chars", len(partial_text))
+			# Return partial response instead of raising error
+			return {
+				"final_output": partial_text,
+				"thread_id": thread_id,
+				"model": envs.AI_ASSISTANT_MODEL or DEFAULT_MODEL,
+				"partial": True
+			}
+	except Exception as partial_err:
+		log.warning("Could not retrieve partial response: %s", partial_err)
+	finally:
+		# The reply is final at this point; stop the run so it is not billed
+		# further and does not block the next message on this thread
+		_cancel_run(client, thread_id, run_id)
+	
+	raise TimeoutError(f"Assistant run timeout after {timeout_s}s")
+
+
+def _start_run(
+	client: "OpenAI",
+	session_id: Optional[str],
+	thread_id: str,
+	message: str,
+	create: Callable[[str], Any],
+) -> Tuple[str, Any]:
+	"""Start a run with create(thread_id), recreating the thread once if OpenAI no longer has it.
+	
+	An active run on the thread is waited out first (see
+	_retry_after_active_run). Used for both polled and streamed runs.
+	
+	Returns:
+		Tuple of (thread_id actually used, result of create)
+	"""
+	import openai
+	
+	try:
+		return thread_id, _retry_after_active_run(client, thread_id, lambda: create(thread_id))
+	except openai.NotFoundError as e:
+		if "thread" not in str(e).lower():
+			raise
+	
+	_log().warning("Thread %s not found when starting run. Creating new thread.", thread_id)
+	thread_id = _create_and_cache_thread(client, session_id)
+	client.beta.threads.messages.create(
+		thread_id=thread_id,
+		role="user",
+		content=message
+	)
+	return thread_id, create(thread_id)
+
+
+def _retry_after_active_run(client: "OpenAI", thread_id: str, create: Callable[[], Any]) -> Any:
+	"""Call create(); if the thread has an active run, wait it out and retry once.
+	
+	OpenAI rejects new messages and runs while a run is active on the thread
+	(e.g. the previous message from the same user is still being answered).
+	The active run gets up to ACTIVE_RUN_WAIT_SECONDS to finish and is then
+	cancelled.
+	"""
+	import openai
+	
+	try:
+		return create()
+	except openai.BadRequestError as e:
+		error_msg = str(e)
+		if "active" not in error_msg.lower() or "run" not in error_msg.lower():
+			raise
+		_wait_out_active_run(client, thread_id, error_msg)
+	
+	return create()
+
+
+def _wait_out_active_run(client: "OpenAI", thread_id: str, error_msg: str) -> None:
+	"""Wait for the thread's active run to finish, cancelling it if it takes too long."""
+	log = _log()
+	
+	match = _RUN_ID_RE.search(error_msg)
+	if match:
+		run_id = match.group(0)
+	else:
+		runs = client.beta.threads.runs.list(thread_id=thread_id, limit=1)
+		if not runs.data:
+			return
+		run_id = runs.data[0].id
+	
+	def fetch_run():
+		return client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+	
+	def finished(r):
+		return r.status not in _RUN_ACTIVE_STATUSES
+	
+	log.debug("Waiting for active run %s on thread %s", run_id, thread_id)
+	if _poll(fetch_run, finished, time.time() + ACTIVE_RUN_WAIT_SECONDS) is not None:
+		return
+	
+	log.warning(
+		"Active run %s still running after %ss. Cancelling to allow new message.",
+		run_id, ACTIVE_RUN_WAIT_SECONDS
+	)
+	if not _cancel_run(client, thread_id, run_id):
+		return
+	try:
+		_poll(fetch_run, finished, time.time() + 5)
+	except Exception as poll_error:
+		log.warning("Failed to confirm cancellation of run %s: %s", run_id, poll_error)
+
+
+def _cancel_run(client: "OpenAI", thread_id: str, run_id: str) -> bool:
+	"""Cancel a run (best-effort). Returns True if the cancel request was accepted."""
+	try:
+		client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+		return True
+	except Exception as cancel_error:
+		_log().warning("Failed to cancel run %s: %s", run_id, cancel_error)
+		return False
+
+
+def _get_run_reply_text(client: "OpenAI", thread_id: str, run_id: str) -> Optional[str]:
+	"""Fetch the text of the latest assistant message created by a run.
+	
+	Citation markers are removed (see _extract_message_clean). Filtering by run_id guarantees the user's own message is never returned
+	when the run has not produced a reply yet (e.g. on timeout).
+	
+	Returns:
+		Message text, or None if the run has produced no message
+	"""
 	messages = client.beta.threads.messages.list(
 		thread_id=thread_id,
+		run_id=run_id,
 		order="desc",
 		limit=1
 	)
 	
 	if not messages.data:
-		raise Exception("No response from assistant")
+		return None
 	
-	# Extract text from message
-	message_content = messages.data[0].content[0]
-	if hasattr(message_content, 'text'):
-		response_text = message_content.text.value
-	else:
-		response_text = str(message_content)
+	return _extract_message_clean(messages.data[0])
+
+
+def _extract_message_clean(message: Any) -> str:
+	"""Extract the text of an assistant message without PDF citation markers.
+	
+	file_search citations come with annotations giving their exact ranges, so
+	the text is rebuilt from the slices between them in one pass. Markers
+	without annotations are still removed by _remove_pdf_citations.
+	"""
+	message_content = message.content[0]
+	if not hasattr(message_content, 'text'):
+		return _remove_pdf_citations(str(message_content))
+	
+	text = message_content.text.value
+	annotations = getattr(message_content.text, 'annotations', None)
+	if annotations:
+		parts = []
+		pos = 0
+		for start, end in sorted((a.start_index, a.end_index) for a in annotations):
+			if start >= pos:
+				parts.append(text[pos:start])
+				pos = end
+		parts.append(text[pos:])
+		text = "".join(parts)
+	
+	return _remove_pdf_citations(text)
+
+
+def _run_error_message(run: Any) -> str:
+	"""Build a user-facing error message for a failed, cancelled or expired run."""
+	error_detail = getattr(run, 'last_error', None)
+	error_msg = f"Run {run.status}"
+	
+	if error_detail:
+		error_code = getattr(error_detail, 'code', 'unknown')
+		error_message = getattr(error_detail, 'message', 'Unknown error')
+		error_msg += f": {error_code} - {error_message}"
+		
+		# Provide helpful message for common errors
+		if error_code == 'server_error':
+			error_msg += "\n\nThis may be a temporary OpenAI issue. Please try again in a moment."
+		elif 'rate_limit' in error_code:
+			error_msg += "\n\nOpenAI rate limit reached. Please wait a moment and try again."
+	
+	return error_msg
+
+
+def _streaming_enabled() -> bool:
+	"""Check if Assistants runs should be streamed instead of polled (AI_ASSISTANTS_STREAMING)."""
+	return envs.AI_ASSISTANTS_STREAMING
+
+
+def _stream_run(
+	client: "OpenAI",
+	thread_id: str,
+	assistant_id: str,
+	session_id: Optional[str],
+	message: str,
+	timeout_s: int,
+) -> Dict[str, Any]:
+	"""Run the assistant over a streaming connection instead of polling.
+	
+	The run is created by runs.stream() through _start_run, so an active run
+	or a thread missing on OpenAI is recovered from as for polled runs; tool
+	calls are answered with submit_tool_outputs_stream() on the same run.
+	The reply is taken from the streamed messages, so neither the poll loop
+	nor a final messages.list request is needed.
+	
+	timeout_s bounds the whole run, across tool-output rounds, like the
+	polled path: past it the run is cancelled and its partial reply is
+	returned, or TimeoutError is raised.
+	"""
+	log = _log()
+	deadline = time.time() + timeout_s
+	
+	def stream_new_run(tid: str) -> Tuple[Any, Optional[List[Any]]]:
+		# OpenAI rejects the run when the stream is opened, before any event
+		# is consumed, so a failed attempt can safely be retried
+		return _consume_stream(client.beta.threads.runs.stream(
+			thread_id=tid,
+			assistant_id=assistant_id,
+			timeout=_remaining(deadline)
+		), deadline)
+	
+	thread_id, (run, messages) = _start_run(client, session_id, thread_id, message, stream_new_run)
+	
+	used_tools = False
+	while messages is not None and run.status == "requires_action":
+		used_tools = True
+		log.info("Assistant requires action: handling tool calls")
+		tool_outputs = _collect_tool_outputs(run, session_id)
+		if time.time() >= deadline:
+			messages = None
+			break
+		run, messages = _consume_stream(client.beta.threads.runs.submit_tool_outputs_stream(
+			thread_id=thread_id,
+			run_id=run.id,
+			tool_outputs=tool_outputs,
+			timeout=_remaining(deadline)
+		), deadline)
+	
+	if messages is None:
+		return _run_timeout_result(client, thread_id, getattr(run, "id", None), timeout_s)
+	
+	if run.status != "completed":
+		error_msg = _run_error_message(run)
+		log.error(error_msg)
+		raise Exception(error_msg)
+	
+	if not messages:
+		raise Exception("No response from assistant")
 	
 	# Remove PDF citations (e.g. 【12:0†file.pdf】)
-	response_text = _remove_pdf_citations(response_text)
+	response_text = _extract_message_clean(messages[-1])
 	
-	_log().info(f"AI response (Assistants API): text_len={len(response_text)} thread={thread_id}")
+	log.info("AI response (Assistants API, streamed): text_len=%s thread=%s", len(response_text), thread_id)
 	
 	return {
 		"final_output": response_text,
 		"thread_id": thread_id,
 		"model": run.model,
-		"api_type": "assistants"
+		"api_type": "assistants",
+		"used_tools": used_tools
 	}
 
 
-def _handle_tool_calls(client: OpenAI, thread_id: str, run: Any, session_id: Optional[str] = None) -> None:
+def _remaining(deadline: float) -> float:
+	"""Seconds left until deadline, as a per-request HTTP timeout (at least 1s)."""
+	return max(1.0, deadline - time.time())
+
+
+def _consume_stream(manager: Any, deadline: float) -> Tuple[Any, Optional[List[Any]]]:
+	"""Read a run's event stream until it ends or the deadline passes.
+	
+	The HTTP timeout of the request only bounds each read, so the deadline
+	is also checked between events.
+	
+	Returns:
+		(final run, messages) when the stream ended, or (latest run seen,
+		None) on timeout; the run is None if no run event arrived
+	"""
+	import openai
+	
+	stream = None
+	try:
+		with manager as stream:
+			for _event in stream:
+				if time.time() >= deadline:
+					return stream.current_run, None
+			return stream.get_final_run(), stream.get_final_messages()
+	except openai.APITimeoutError:
+		# Also raised when opening the stream, before any run event
+		return (stream.current_run if stream is not None else None), None
+
+
+def _handle_tool_calls(client: "OpenAI", thread_id: str, run: Any, session_id: Optional[str] = None) -> None:
 	"""Handle tool calls requested by the Assistant.
 	
+	Calls run through tool_executor (serially unless all are read-only) and
+	outputs are submitted in the original order.
+	
 	Args:
 		client: OpenAI client
 		thread_id: Thread ID
 		run: Run object with requires_action status
 		session_id: Session ID to inject phone_from
 	"""
-	from .tool_registry import get_tool_impl
-	from .threads import _sanitize_tool_args
-	
 	if not run.required_action or not run.required_action.submit_tool_outputs:
 		return
 	
-	tool_calls = run.required_action.submit_tool_outputs.tool_calls
-	tool_outputs = []
-	
-	for tool_call in tool_calls:
-		function_name = tool_call.function.name
-		arguments = json.loads(tool_call.function.arguments)
-		
-		_log().info(f"Executing tool: {function_name} with args: {arguments}")
-		
-		try:
-			# Inject phone_from from session mapping (security)
-			if session_id:
-				arguments = _sanitize_tool_args(arguments, session_id)
-			
-			# Get tool implementation
-			tool_func = get_tool_impl(function_name)
-			
-			if not tool_func:
-				output = {"error": f"Tool {function_name} not found"}
-			else:
-				# Execute tool
-				result = tool_func(**arguments)
-				output = result if isinstance(result, dict) else {"result": result}
-		
-		except Exception as e:
-			_log().error(f"Tool execution error: {function_name} - {str(e)}")
-			output = {"error": str(e)}
-		
-		# Serialize output, handling datetime and other non-JSON types
-		try:
-			output_json = json.dumps(output, default=_json_serializer)
-		except Exception as e:
-			_log().error(f"JSON serialization error: {str(e)}")
-			output_json = json.dumps({"error": "Serialization failed", "message": str(e)})
-		
-		tool_outputs.append({
-			"tool_call_id": tool_call.id,
-			"output": output_json
-		})
-		
-		_log().info(f"Tool {function_name} output: {output}")
+	tool_outputs = _collect_tool_outputs(run, session_id)
 	
 	# Submit all tool outputs back to the Assistant
 	client.beta.threads.runs.submit_tool_outputs(
@@ -501,16 +1045,78 @@ def _handle_tool_calls(client: OpenAI, thread_id: str, run: Any, session_id: Opt
 		tool_outputs=tool_outputs
 	)
 	
-	_log().info(f"Submitted {len(tool_outputs)} tool outputs")
+	_log().info("Submitted %s tool outputs", len(tool_outputs))
+
+
+def _collect_tool_outputs(run: Any, session_id: Optional[str]) -> List[Dict[str, str]]:
+	"""Execute the tool calls of a requires_action run and return their outputs."""
+	tool_calls = run.required_action.submit_tool_outputs.tool_calls
+	
+	return execute_tool_calls(
+		tool_calls,
+		[tool_call.function.name for tool_call in tool_calls],
+		lambda tool_call: _exec_one_tool(tool_call, session_id),
+		lambda tool_call, exc: {"tool_call_id": tool_call.id, "output": json.dumps({"error": str(exc)})},
+	)
+
+
+def _exec_one_tool(tool_call: Any, session_id: Optional[str]) -> Dict[str, str]:
+	"""Execute one tool call and return its submit_tool_outputs entry."""
+	log = _log()
+	
+	function_name = tool_call.function.name
+	
+	try:
+		arguments = _loads_tool_args(tool_call.function.arguments)
+		log.info("Executing tool: %s with args: %s", function_name, arguments)
+		
+		# Inject phone_from from session mapping (security)
+		if session_id:
+			arguments = _sanitize_tool_args(arguments, session_id, function_name)
+		
+		# Get tool implementation
+		tool_func = get_tool_impl(function_name)
+		
+		if not tool_func:
+			output = {"error": f"Tool {function_name} not found"}
+		else:
+			# Execute tool
+			result = tool_func(**arguments)
+			output = result if isinstance(result, dict) else {"result": result}
+	
+	except Exception as e:
+		log.error("Tool execution error: %s - %s", function_name, e)
+		output = {"error": str(e)}
+	
+	# Serialize output, handling datetime and other non-JSON types
+	try:
+		output_json = _dumps_tool_output(output)
+	except Exception as e:
+		log.error("JSON serialization error: %s", e)
+		output_json = json.dumps({"error": "Serialization failed", "message": str(e)})
+	
+	log.info("Tool %s output: %s", function_name, output)
+	
+	return {
+		"tool_call_id": tool_call.id,
+		"output": output_json
+	}
 
 
 def _json_serializer(obj):
-	"""JSON serializer for objects not serializable by default json code."""
-	from datetime import datetime, date
+	"""JSON serializer for objects not serializable by default json code.
 	
+	orjson encodes datetimes, dates and UUIDs itself and only calls this for
+	other types (Frappe documents, Decimal, ...).
+	"""
 	if isinstance(obj, (datetime, date)):
 		return obj.isoformat()
 	
+	# Frappe documents returned as-is by tools
+	as_dict = getattr(obj, "as_dict", None)
+	if callable(as_dict):
+		return as_dict()
+	
 	# Try to convert to string for other types
 	try:
 		return str(obj)
@@ -518,11 +1124,33 @@ def _json_serializer(obj):
 		return None
 
 
-def _get_or_create_thread(client: OpenAI, session_id: Optional[str]) -> str:
+def _loads_tool_args(raw: Any) -> Dict[str, Any]:
+	"""Parse tool call arguments, using orjson when it is installed."""
+	if isinstance(raw, dict):
+		return raw
+	if orjson is not None:
+		return orjson.loads(raw)
+	return json.loads(raw)
+
+
+# Reused for every tool output instead of building an encoder per json.dumps call
+_TOOL_OUTPUT_ENCODER = json.JSONEncoder(default=_json_serializer)
+
+
+def _dumps_tool_output(output: Any) -> str:
+	"""Serialize a tool output to JSON, using orjson when it is installed."""
+	if orjson is not None:
+		return orjson.dumps(output, default=_json_serializer, option=orjson.OPT_NON_STR_KEYS).decode()
+	return _TOOL_OUTPUT_ENCODER.encode(output)
+
+
+def _get_or_create_thread(client: "OpenAI", session_id: Optional[str]) -> str:
 	"""Get existing thread or create new one for session.
 	
-	Maps session_id to OpenAI thread_id using local file storage.
-	Validates that thread still exists on OpenAI before reusing.
+	Maps session_id to OpenAI thread_id in the site's kv store, read through a
+	site-scoped Redis hash shared by all workers. Cached threads are not
+	verified here; callers recreate the thread if OpenAI reports it missing
+	(see _create_and_cache_thread).
 	"""
 	if not session_id:
 		# No session, create new thread
@@ -530,133 +1158,176 @@ def _get_or_create_thread(client: OpenAI, session_id: Optional[str]) -> str:
 		return thread.id
 	
 	# Check if thread exists for this session
-	thread_map_path = _get_thread_map_path()
-	thread_map = _load_json_file(thread_map_path)
-	
-	if session_id in thread_map:
-		thread_id = thread_map[session_id]
-		_log().debug(f"Found cached thread {thread_id} for session {session_id}")
-		
-		# Verify thread still exists on OpenAI
-		try:
-			client.beta.threads.retrieve(thread_id)
-			_log().debug(f"Thread {thread_id} verified on OpenAI")
-			return thread_id
-		except Exception as e:
-			_log().warning(f"Cached thread {thread_id} not found on OpenAI: {e}. Creating new thread.")
-			# Remove invalid thread from cache
-			del thread_map[session_id]
-			_save_json_file(thread_map_path, thread_map)
+	thread_id = _lookup_thread_id(session_id)
+	if thread_id:
+		_log().debug("Found cached thread %s for session %s", thread_id, session_id)
+		return thread_id
 	
-	# Create new thread and save mapping
+	return _create_and_cache_thread(client, session_id)
+
+
+def _create_and_cache_thread(client: "OpenAI", session_id: Optional[str]) -> str:
+	"""Create a new thread and store it as the session's thread."""
 	thread = client.beta.threads.create()
-	thread_map[session_id] = thread.id
-	_save_json_file(thread_map_path, thread_map)
+	if not session_id:
+		return thread.id
+	
+	# The kv store is the source of truth; Redis is refreshed right after so
+	# other workers stop using the previous thread immediately
+	try:
+		kv_store.kv_set(THREAD_MAP_TABLE, session_id, thread.id)
+	except Exception as e:
+		_log().error("Failed to persist thread %s for session %s: %s", thread.id, session_id, e)
+	_cache_thread_id(session_id, thread.id)
 	
-	_log().info(f"Created new thread {thread.id} for session {session_id}")
+	_log().info("Created new thread %s for session %s", thread.id, session_id)
 	return thread.id
 
 
+def _lookup_thread_id(session_id: str) -> Optional[str]:
+	"""Get the session's thread id from Redis, falling back to the kv store."""
+	_migrate_thread_map_file()
+	thread_id = frappe.cache().hget(THREAD_MAP_CACHE_KEY, session_id)
+	if thread_id:
+		return thread_id
+	
+	try:
+		thread_id = kv_store.kv_get(THREAD_MAP_TABLE, session_id)
+	except Exception as e:
+		_log().error("Failed to load thread for session %s: %s", session_id, e)
+		return None
+	if thread_id:
+		_cache_thread_id(session_id, thread_id)
+	return thread_id
+
+
+def _cache_thread_id(session_id: str, thread_id: str) -> None:
+	"""Store a session's thread id in the Redis read-through cache."""
+	cache = frappe.cache()
+	cache.hset(THREAD_MAP_CACHE_KEY, session_id, thread_id)
+	cache.expire(cache.make_key(THREAD_MAP_CACHE_KEY), THREAD_MAP_TTL_SECONDS)
+
+
 # Thread locks per serializzare messaggi dello stesso utente quando usa Assistants API
 # Production-ready: previene race conditions quando lo stesso utente invia messaggi rapidi
-_thread_locks: Dict[str, threading.Lock] = {}
-_locks_lock = threading.Lock()  # Lock per gestire il dict dei locks
+# The table is sharded by session hash (no global lock) and holds locks weakly,
+# so an entry disappears as soon as no request is using that session's lock.
+_LOCK_SHARD_COUNT = 64
+_LOCK_SHARDS: Tuple[Tuple[threading.Lock, "weakref.WeakValueDictionary[str, _SessionLock]"], ...] = tuple(
+	(threading.Lock(), weakref.WeakValueDictionary()) for _ in range(_LOCK_SHARD_COUNT)
+)
 
 
-def _get_thread_lock(session_id: str) -> threading.Lock:
+class _SessionLock:
+	"""Weak-referenceable wrapper around threading.Lock (plain locks are not)."""
+	
+	__slots__ = ("_lock", "__weakref__")
+	
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+	
+	def __enter__(self) -> "_SessionLock":
+		self._lock.acquire()
+		return self
+	
+	def __exit__(self, *exc_info: Any) -> None:
+		self._lock.release()
+
+
+def _get_thread_lock(session_id: str) -> _SessionLock:
 	"""Get or create a thread lock for a session_id.
 	
 	This ensures messages from the same user are processed sequentially
 	when using Assistants API (which doesn't allow concurrent runs on same thread).
+	The caller must keep the returned lock referenced while using it.
 	"""
-	with _locks_lock:
-		if session_id not in _thread_locks:
-			_thread_locks[session_id] = threading.Lock()
-		return _thread_locks[session_id]
+	shard_lock, locks = _LOCK_SHARDS[hash(session_id) % _LOCK_SHARD_COUNT]
+	with shard_lock:
+		lock = locks.get(session_id)
+		if lock is None:
+			lock = _SessionLock()
+			locks[session_id] = lock
+		return lock
+
 
+# Legacy JSON thread map (pre-Redis storage) in private/files
+LEGACY_THREAD_MAP_FILE = "ai_assistants_threads.json"
 
-def _get_thread_map_path() -> str:
-	"""Get path to thread mapping file."""
-	import os
-	site_path = frappe.utils.get_site_path()
-	return os.path.join(site_path, "private", "files", "ai_assistants_threads.json")
+# Sites whose legacy thread maps have been checked in this process
+_MIGRATED_SITES: Set[str] = set()
 
 
-def _load_json_file(path: str) -> dict:
-	"""Load JSON file or return empty dict."""
-	import json
-	import os
+def _migrate_thread_map_file() -> None:
+	"""Copy legacy thread maps into the kv store (once per site per process).
 	
-	if not os.path.exists(path):
-		return {}
+	Earlier versions kept the map in a JSON file, then moved it to Redis only
+	(renaming the file to "<name>.migrated"). The Redis hash and that renamed
+	file are imported once per site database; a JSON file still in place is
+	imported and renamed after its rows are committed. Rows already in the
+	kv store win.
+	"""
+	site = frappe.local.site
+	if site in _MIGRATED_SITES:
+		return
+	_MIGRATED_SITES.add(site)
 	
 	try:
-		with open(path, "r") as f:
-			content = f.read().strip()
-			return json.loads(content) if content else {}
-	except Exception:
-		return {}
+		if kv_store.run_once("assistants_threads_from_redis", THREAD_MAP_TABLE, _legacy_thread_rows):
+			_log().info("Imported Assistants threads from Redis into the kv store")
+		kv_store.import_json_map(THREAD_MAP_TABLE, LEGACY_THREAD_MAP_FILE)
+	except Exception as e:
+		_log().error("Failed to migrate the Assistants thread map: %s", e)
 
 
-def _save_json_file(path: str, data: dict) -> None:
-	"""Save dict to JSON file."""
-	import json
-	import os
-	
-	# Ensure directory exists with proper permissions
-	dir_path = os.path.dirname(path)
-	os.makedirs(dir_path, mode=0o755, exist_ok=True)
+def _legacy_thread_rows() -> List[Tuple[str, str]]:
+	"""Collect session -> thread rows from the Redis hash and the migrated file."""
+	rows = [
+		(str(session_id), str(thread_id))
+		for session_id, thread_id in (frappe.cache().hgetall(THREAD_MAP_CACHE_KEY) or {}).items()
+		if thread_id
+	]
 	
+	migrated_path = f"{get_map_path(LEGACY_THREAD_MAP_FILE)}.migrated"
 	try:
-		with open(path, "w") as f:
-			json.dump(data, f, indent=2)
-		# Set file permissions
-		os.chmod(path, 0o644)
-	except Exception as e:
-		_log().error(f"Failed to save JSON file {path}: {e}")
-		raise
+		legacy = read_map_file(migrated_path)
+	except FileNotFoundError:
+		legacy = {}
+	rows.extend((str(session_id), str(thread_id)) for session_id, thread_id in legacy.items() if thread_id)
+	return rows
 
 
-def delete_vector_store(vector_store_id: str) -> bool:
+def delete_vector_store(vector_store_id: str, client: Optional["OpenAI"] = None) -> bool:
 	"""Delete a Vector Store from OpenAI."""
-	from .config import apply_environment, get_environment
-	
 	try:
-		apply_environment()
-		env = get_environment()
-		api_key = env.get("OPENAI_API_KEY")
-		
-		if not api_key:
-			return False
+		if client is None:
+			api_key = _get_api_key()
+			if not api_key:
+				return False
+			client = get_openai_client(api_key)
 		
-		client = OpenAI(api_key=api_key)
 		client.vector_stores.delete(vector_store_id)
 		
-		_log().info(f"Deleted Vector Store: {vector_store_id}")
+		_log().info("Deleted Vector Store: %s", vector_store_id)
 		return True
 	except Exception as e:
-		_log().warning(f"Failed to delete Vector Store {vector_store_id}: {e}")
+		_log().warning("Failed to delete Vector Store %s: %s", vector_store_id, e)
 		return False
 
 
-def delete_assistant(assistant_id: str) -> bool:
+def delete_assistant(assistant_id: str, client: Optional["OpenAI"] = None) -> bool:
 	"""Delete an Assistant from OpenAI."""
-	from .config import apply_environment, get_environment
-	
 	try:
-		apply_environment()
-		env = get_environment()
-		api_key = env.get("OPENAI_API_KEY")
-		
-		if not api_key:
-			return False
+		if client is None:
+			api_key = _get_api_key()
+			if not api_key:
+				return False
+			client = get_openai_client(api_key)
 		
-		client = OpenAI(api_key=api_key)
 		client.beta.assistants.delete(assistant_id)
 		
-		_log().info(f"Deleted Assistant: {assistant_id}")
+		_log().info("Deleted Assistant: %s", assistant_id)
 		return True
 	except Exception as e:
-		_log().warning(f"Failed to delete Assistant {assistant_id}: {e}")
+		_log().warning("Failed to delete Assistant %s: %s", assistant_id, e)
 		return False
 
@@ -12,9 +12,18 @@ from __future__ import annotations
 
 import frappe
 import os
+import threading
+from typing import Optional, Set
 
+from . import envs
 from .config import apply_environment
 from .logger_utils import get_resilient_logger
+from .openai_client import warm_openai_client
+
+
+# Sites whose one-time setup (directories, tools, warm-up) has run in this process
+_INITIALIZED_SITES: Set[Optional[str]] = set()
+_INIT_LOCK = threading.Lock()
 
 
 def _log():
@@ -36,11 +45,14 @@ def _ensure_whatsapp_directories() -> None:
 		_log().warning(f"Failed to ensure WhatsApp directories: {exc}")
 
 
-def _register_tools() -> None:
+def _register_tools() -> bool:
 	"""Register Python tool implementations for AI function calling.
 	
 	Best-effort registration - fails silently if tools module unavailable.
 	This allows the system to work even if tool dependencies aren't installed.
+	
+	Returns:
+		False if registration failed and should be retried on the next call
 	"""
 	try:
 		from .assistant_spec import register_tool_impls
@@ -50,6 +62,25 @@ def _register_tools() -> None:
 		_log().debug("Tool implementations not available - skipping registration")
 	except Exception as exc:
 		_log().warning(f"Failed to register tool implementations: {exc}")
+		return False
+	return True
+
+
+def _warm_openai_connection() -> None:
+	"""Pre-open the shared OpenAI client's TLS connection (best-effort).
+	
+	Runs in a background thread once per process and API key, so the first
+	AI request does not pay the handshake.
+	"""
+	if getattr(frappe.flags, "in_install", False):
+		return
+	
+	try:
+		api_key = envs.OPENAI_API_KEY
+		if api_key:
+			warm_openai_client(api_key)
+	except Exception as exc:
+		_log().debug(f"Skipping OpenAI connection warm-up: {exc}")
 
 
 def initialize() -> None:
@@ -59,9 +90,12 @@ def initialize() -> None:
 	1. Apply OpenAI environment variables (API key, org, project, etc.)
 	2. Register tool implementations for function calling
 	3. Ensure WhatsApp data directories exist
+	4. Warm the shared OpenAI connection pool in the background
 	
 	This is idempotent and safe to call multiple times. Designed to be
-	lightweight so it can be called per-request or per-job without overhead.
+	lightweight so it can be called per-request or per-job without overhead:
+	the environment is applied on every call (os.environ is shared by all
+	sites served by the process), steps 2-4 run once per site and process.
 	
 	Called by:
 	- before_request() hook (for web requests)
@@ -71,11 +105,37 @@ def initialize() -> None:
 	# Apply OpenAI environment configuration
 	apply_environment()
 	
-	# Ensure WhatsApp directories exist
-	_ensure_whatsapp_directories()
+	site = getattr(frappe.local, "site", None)
+	if site in _INITIALIZED_SITES:
+		return
 	
-	# Register tool implementations
-	_register_tools()
+	with _INIT_LOCK:
+		if site in _INITIALIZED_SITES:
+			return
+		
+		# Ensure WhatsApp directories exist
+		_ensure_whatsapp_directories()
+		
+		# Register tool implementations
+		tools_registered = _register_tools()
+		
+		# Open the OpenAI connection ahead of the first API call
+		_warm_openai_connection()
+		
+		# A failed registration leaves the site uninitialized, so the next call retries it
+		if tools_registered:
+			_INITIALIZED_SITES.add(site)
+
+
+def reinitialize() -> None:
+	"""Run the one-time setup for the current site again.
+	
+	Use after configuration changes (e.g. a new API key) so directories,
+	tools and the connection warm-up are refreshed on the next call.
+	"""
+	with _INIT_LOCK:
+		_INITIALIZED_SITES.discard(getattr(frappe.local, "site", None))
+	initialize()
 
 
 def before_request() -> None:
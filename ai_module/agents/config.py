@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import os
-from typing import Dict, Optional
+import re
+from collections.abc import Mapping as MappingABC
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
 
 import frappe
 from frappe.utils.html_utils import clean_html
@@ -14,12 +17,63 @@ OPENAI_ORG_ID = "OPENAI_ORG_ID"
 OPENAI_PROJECT = "OPENAI_PROJECT"
 OPENAI_BASE_URL = "OPENAI_BASE_URL"
 
+# Keys copied into os.environ by apply_environment() for the OpenAI SDK
+_OPENAI_APPLY_KEYS: Tuple[str, ...] = (OPENAI_API_KEY, OPENAI_ORG_ID, OPENAI_PROJECT, OPENAI_BASE_URL)
+
+# Keys read from the process environment (os.environ). Only these are looked
+# up instead of copying the whole environment; frappe.conf.environment and
+# DocType overrides are merged in full.
+_SUPPORTED_KEYS: Tuple[str, ...] = (
+	OPENAI_API_KEY,
+	OPENAI_ORG_ID,
+	OPENAI_PROJECT,
+	OPENAI_BASE_URL,
+	"AI_AGENT_NAME",
+	"AI_ASSISTANT_NAME",
+	"AI_ASSISTANT_MODEL",
+	"AI_ASSISTANT_INSTRUCTIONS",
+	"AI_INSTRUCTIONS",
+	"AI_AUTOREPLY",
+	"AI_HUMAN_COOLDOWN_SECONDS",
+	"AI_WHATSAPP_COOLDOWN",
+	"AI_WHATSAPP_INLINE",
+	"AI_WHATSAPP_QUEUE",
+	"AI_WHATSAPP_TIMEOUT",
+	"AI_WHATSAPP_REACTION",
+	"AI_WHATSAPP_REACTION_EMOJI",
+	"AI_ASSISTANTS_STREAMING",
+	"AI_ASSISTANTS_BATCH_WINDOW_MS",
+	"AI_SEMANTIC_CACHE",
+	"AI_SEMANTIC_CACHE_THRESHOLD",
+)
+
+# Per-site caches: site -> (settings version, value). Entries are reused until
+# the AI Assistant Settings document is saved again (its `modified` changes),
+# so saves in one worker are picked up by every other worker.
+_ENV_CACHE: Dict[Optional[str], Tuple[Any, Tuple[Any, Any], "EnvView"]] = {}
+_ENV_SPEC_CACHE: Dict[Optional[str], Tuple[Any, Tuple[Any, Any], Optional[Dict[str, str]]]] = {}
+_ASSISTANT_ID_CACHE: Dict[Optional[str], Tuple[Any, Optional[str]]] = {}
+_API_KEY_CACHE: Dict[Optional[str], Tuple[Any, Optional[str]]] = {}
+_PROMPT_CACHE: Dict[Optional[str], Tuple[Any, Optional[str]]] = {}
+
 
 def _log():
 	"""Get Frappe logger for config module."""
 	return get_resilient_logger("ai_module.config")
 
 
+def _raw_frappe_environment() -> Any:
+	"""Return frappe.conf.environment as configured (may be None or any type)."""
+	# Try attribute access first (most common)
+	env_from_conf = getattr(frappe.conf, "environment", None)
+	
+	# Fallback to dict-style access for some deployments
+	if env_from_conf is None:
+		env_from_conf = getattr(frappe.conf, "get", lambda x: None)("environment")
+	
+	return env_from_conf
+
+
 def _get_frappe_environment() -> Dict[str, str]:
 	"""Get environment variables from Frappe configuration.
 	
@@ -30,12 +84,7 @@ def _get_frappe_environment() -> Dict[str, str]:
 	Returns:
 		Dict of environment variables (normalized to strings)
 	"""
-	# Try attribute access first (most common)
-	env_from_conf = getattr(frappe.conf, "environment", None)
-	
-	# Fallback to dict-style access for some deployments
-	if env_from_conf is None:
-		env_from_conf = getattr(frappe.conf, "get", lambda x: None)("environment")
+	env_from_conf = _raw_frappe_environment()
 	
 	# Normalize to dict with string keys/values
 	if isinstance(env_from_conf, dict):
@@ -44,15 +93,65 @@ def _get_frappe_environment() -> Dict[str, str]:
 	return {}
 
 
-def _get_ai_settings():
+def _environment_fingerprint() -> Tuple[Any, Any]:
+	"""Cheap fingerprint of the non-DocType environment sources.
+	
+	Combines the supported OS environment values with the contents of
+	frappe.conf.environment, so a cached merge is rebuilt when either changes.
+	"""
+	env_from_conf = _raw_frappe_environment()
+	conf_items = tuple(env_from_conf.items()) if isinstance(env_from_conf, dict) else None
+	return tuple(map(os.environ.get, _SUPPORTED_KEYS)), conf_items
+
+
+# frappe.local attribute holding the settings doc for the current request
+_SETTINGS_LOCAL_KEY = "ai_assistant_settings"
+# Stored in place of the doc when it could not be loaded during this request
+_SETTINGS_MISSING = object()
+
+
+def get_ai_settings():
 	"""Get AI Assistant Settings singleton if available.
 	
+	Uses Frappe's document cache (Redis) instead of loading the Single from
+	the database, and keeps the result on frappe.local so repeated reads in
+	the same request or job skip the cache round-trip too; Frappe clears the
+	cached doc when it is saved and frappe.local is reset per request.
+	The returned document is shared and must be treated as read-only; use
+	frappe.get_single() for a copy to modify and save.
+	
 	Returns None if DocType is not installed or not accessible.
 	"""
-	try:
-		return frappe.get_single("AI Assistant Settings")
-	except Exception:
-		return None
+	settings = getattr(frappe.local, _SETTINGS_LOCAL_KEY, None)
+	if settings is None:
+		try:
+			settings = frappe.get_cached_doc("AI Assistant Settings")
+		except Exception:
+			settings = _SETTINGS_MISSING
+		setattr(frappe.local, _SETTINGS_LOCAL_KEY, settings)
+	
+	return None if settings is _SETTINGS_MISSING else settings
+
+
+def _cache_key() -> Tuple[Optional[str], Any]:
+	"""Return (site, settings version) used to validate per-site caches."""
+	settings = get_ai_settings()
+	version = getattr(settings, "modified", None) if settings else None
+	return getattr(frappe.local, "site", None), version
+
+
+def reload_environment() -> None:
+	"""Drop cached environment data so the next read rebuilds it.
+	
+	Called when AI Assistant Settings are saved. Other workers pick up the
+	change on their own because cache entries are tied to the settings version.
+	"""
+	if hasattr(frappe.local, _SETTINGS_LOCAL_KEY):
+		delattr(frappe.local, _SETTINGS_LOCAL_KEY)
+	_ENV_CACHE.clear()
+	_ENV_SPEC_CACHE.clear()
+	_API_KEY_CACHE.clear()
+	_PROMPT_CACHE.clear()
 
 
 def _get_decrypted_api_key(settings_instance=None) -> Optional[str]:
@@ -121,7 +220,23 @@ def _get_decrypted_api_key(settings_instance=None) -> Optional[str]:
 		return None
 
 
-def _get_settings_overrides(settings_instance=None) -> Dict[str, str]:
+def _get_saved_api_key() -> Optional[str]:
+	"""Get the decrypted API key of the saved settings, cached per site.
+	
+	The password lookup (an __Auth query plus decryption) runs once per
+	settings version instead of on every read.
+	"""
+	site, version = _cache_key()
+	cached = _API_KEY_CACHE.get(site)
+	if cached is not None and cached[0] == version:
+		return cached[1]
+	
+	api_key = _get_decrypted_api_key()
+	_API_KEY_CACHE[site] = (version, api_key)
+	return api_key
+
+
+def _get_settings_overrides(settings_instance=None, include_api_key: bool = True) -> Dict[str, str]:
 	"""Extract environment overrides from AI Assistant Settings DocType.
 	
 	Only returns overrides if use_settings_override flag is enabled.
@@ -129,6 +244,7 @@ def _get_settings_overrides(settings_instance=None) -> Dict[str, str]:
 	
 	Args:
 		settings_instance: Optional DocType instance to use (for unsaved changes)
+		include_api_key: Decrypt and include the API key (EnvView defers it)
 	
 	Returns:
 		Dict of environment variable overrides
@@ -137,7 +253,7 @@ def _get_settings_overrides(settings_instance=None) -> Dict[str, str]:
 	if settings_instance:
 		settings = settings_instance
 	else:
-		settings = _get_ai_settings()
+		settings = get_ai_settings()
 	
 	if not settings or not getattr(settings, "use_settings_override", 0):
 		return {}
@@ -145,9 +261,10 @@ def _get_settings_overrides(settings_instance=None) -> Dict[str, str]:
 	overrides: Dict[str, str] = {}
 	
 	# API key (encrypted field)
-	api_key = _get_decrypted_api_key(settings_instance=settings)
-	if api_key:
-		overrides[OPENAI_API_KEY] = api_key
+	if include_api_key:
+		api_key = _get_decrypted_api_key(settings_instance=settings)
+		if api_key:
+			overrides[OPENAI_API_KEY] = api_key
 	
 	# Optional provider configuration fields
 	field_mapping = {
@@ -188,31 +305,114 @@ def _get_settings_overrides(settings_instance=None) -> Dict[str, str]:
 	return overrides
 
 
-def get_environment(settings_instance=None) -> Dict[str, str]:
+class EnvView(MappingABC):
+	"""Read-only merged environment that decrypts the API key on first access.
+	
+	Most readers only need plain settings (model, flags, timeouts); the
+	password decrypt for OPENAI_API_KEY runs only when that key is read or
+	the view is iterated, and its result is kept for the view's lifetime.
+	"""
+	
+	__slots__ = ("_data", "_api_key_resolved")
+	
+	def __init__(self, data: Dict[str, str], settings_api_key: bool = False):
+		self._data = data
+		self._api_key_resolved = not settings_api_key
+	
+	def _resolve_api_key(self) -> None:
+		if self._api_key_resolved:
+			return
+		api_key = _get_saved_api_key()
+		if api_key:
+			self._data[OPENAI_API_KEY] = api_key
+		self._api_key_resolved = True
+	
+	def __getitem__(self, key: str) -> str:
+		if key == OPENAI_API_KEY:
+			self._resolve_api_key()
+		return self._data[key]
+	
+	def __contains__(self, key: object) -> bool:
+		if key == OPENAI_API_KEY:
+			self._resolve_api_key()
+		return key in self._data
+	
+	def __iter__(self) -> Iterator[str]:
+		self._resolve_api_key()
+		return iter(self._data)
+	
+	def __len__(self) -> int:
+		self._resolve_api_key()
+		return len(self._data)
+
+
+def get_environment(settings_instance=None) -> Mapping[str, str]:
 	"""Get merged environment variables from all sources.
 	
 	Precedence order (later overrides earlier):
-	1. OS environment variables (os.environ)
+	1. OS environment variables (os.environ, _SUPPORTED_KEYS only)
 	2. Frappe Cloud environment (frappe.conf.environment)
 	3. AI Assistant Settings DocType (if use_settings_override enabled)
 	
 	This allows configuration via Frappe Cloud GUI or DocType without
 	code changes, with DocType having highest priority for flexibility.
 	
+	The merged view is cached per site until the settings document changes
+	or frappe.conf.environment / the set of OS variables does (see
+	_environment_fingerprint); it is read-only and shared between callers.
+	Passing settings_instance bypasses the cache. Use get_environment_fresh()
+	when a read must not be served from cache, or reload_environment() to
+	drop all cached data.
+	
 	Args:
 		settings_instance: Optional DocType instance to use (for unsaved changes)
 	
 	Returns:
-		Dict of all environment variables
+		Read-only mapping of all environment variables
+	"""
+	if settings_instance is not None:
+		return _build_environment(settings_instance=settings_instance)
+	
+	site, version = _cache_key()
+	fingerprint = _environment_fingerprint()
+	cached = _ENV_CACHE.get(site)
+	if cached is not None and cached[0] == version and cached[1] == fingerprint:
+		return cached[2]
+	
+	settings = get_ai_settings()
+	merged = _build_environment(include_api_key=False)
+	override_active = bool(settings and getattr(settings, "use_settings_override", 0))
+	view = EnvView(merged, settings_api_key=override_active)
+	_ENV_CACHE[site] = (version, fingerprint, view)
+	return view
+
+
+def get_environment_fresh() -> Mapping[str, str]:
+	"""Rebuild the current site's environment, bypassing cached values.
+	
+	For rare admin and diagnostic flows that must see configuration changed
+	outside the settings form (e.g. a rotated API key). Hot paths should use
+	get_environment(). The rebuilt view replaces the cached one.
 	"""
-	# Start with OS environment
-	merged: Dict[str, str] = dict(os.environ)
+	site = getattr(frappe.local, "site", None)
+	if hasattr(frappe.local, _SETTINGS_LOCAL_KEY):
+		delattr(frappe.local, _SETTINGS_LOCAL_KEY)
+	_ENV_CACHE.pop(site, None)
+	_API_KEY_CACHE.pop(site, None)
+	return get_environment()
+
+
+def _build_environment(settings_instance=None, include_api_key: bool = True) -> Dict[str, str]:
+	"""Merge OS, Frappe and DocType environment sources (uncached)."""
+	# Start with the supported OS environment keys
+	environ = os.environ
+	merged: Dict[str, str] = {key: value for key in _SUPPORTED_KEYS if (value := environ.get(key))}
 	
 	# Override with Frappe-specific environment
 	merged.update(_get_frappe_environment())
 	
 	# Override with DocType settings (highest priority)
-	merged.update(_get_settings_overrides(settings_instance=settings_instance))
+	merged.update(_get_settings_overrides(settings_instance=settings_instance, include_api_key=include_api_key))
 	
 	return merged
 
@@ -237,13 +437,65 @@ def apply_environment(settings_instance=None) -> None:
 	"""
 	env = get_environment(settings_instance=settings_instance)
 	
-	# Apply OpenAI-specific environment variables
-	openai_keys = [OPENAI_API_KEY, OPENAI_ORG_ID, OPENAI_PROJECT, OPENAI_BASE_URL]
-	
-	for key in openai_keys:
+	# Apply OpenAI-specific environment variables (skip unchanged values)
+	environ = os.environ
+	for key in _OPENAI_APPLY_KEYS:
 		value = env.get(key)
-		if value:
-			os.environ[key] = value
+		if value and environ.get(key) != value:
+			environ[key] = value
+
+
+# Tags that start a new line in extracted text; paragraph-like ones also end it
+_BLOCK_TAGS = frozenset({
+	"p", "div", "br", "li", "ul", "ol", "tr", "table",
+	"h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote",
+})
+_PARAGRAPH_TAGS = frozenset({"p", "div", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "table"})
+_EXTRA_NEWLINES_RE = re.compile(r"\n{3,}")
+
+
+class _TextExtractor(HTMLParser):
+	"""Streaming tag stripper for the sanitized instructions field.
+	
+	Emits text nodes as they are parsed (entities decoded), turns block tags
+	into line breaks and drops script/style content, without building a tree.
+	"""
+	
+	def __init__(self):
+		super().__init__(convert_charrefs=True)
+		self._parts = []
+		self._skip_depth = 0
+	
+	def handle_starttag(self, tag, attrs):
+		if tag in ("script", "style"):
+			self._skip_depth += 1
+		elif tag in _BLOCK_TAGS:
+			self._parts.append("\n")
+	
+	def handle_endtag(self, tag):
+		if tag in ("script", "style"):
+			self._skip_depth = max(0, self._skip_depth - 1)
+		elif tag in _PARAGRAPH_TAGS:
+			self._parts.append("\n")
+	
+	def handle_data(self, data):
+		if not self._skip_depth:
+			self._parts.append(data)
+	
+	def text(self) -> str:
+		return _EXTRA_NEWLINES_RE.sub("\n\n", "".join(self._parts))
+
+
+def _html_to_text(html: str) -> str:
+	"""Convert instructions HTML to plain text.
+	
+	Frappe's clean_html sanitizes the field as before; the tags it keeps
+	(<p>, <li>, ...) are then stripped so the prompt carries no markup.
+	"""
+	parser = _TextExtractor()
+	parser.feed(clean_html(html))
+	parser.close()
+	return parser.text()
 
 
 def get_settings_prompt_only() -> Optional[str]:
@@ -251,20 +503,29 @@ def get_settings_prompt_only() -> Optional[str]:
 	
 	Only returns instructions if use_settings_override flag is enabled,
 	otherwise returns None to allow environment variables to take precedence.
-	Converts HTML instructions to plain text.
+	Converts HTML instructions to plain text; the result is cached per site
+	until the settings document changes.
 	
 	Returns:
 		Plain-text instructions or None
 	"""
-	settings = _get_ai_settings()
-	if not settings or not getattr(settings, "use_settings_override", 0):
-		return None
+	site, version = _cache_key()
+	cached = _PROMPT_CACHE.get(site)
+	if cached is not None and cached[0] == version:
+		return cached[1]
 	
-	# Extract and clean HTML instructions
-	instructions_html = getattr(settings, "instructions", "") or ""
-	instructions_text = clean_html(instructions_html).strip()
-	
-	return instructions_text or None
+	settings = get_ai_settings()
+	if not settings or not getattr(settings, "use_settings_override", 0):
+		instructions_text = None
+	else:
+		# Extract and clean HTML instructions (plain text needs no parsing)
+		instructions_html = getattr(settings, "instructions", "") or ""
+		if "<" in instructions_html or "&" in instructions_html:
+			instructions_html = _html_to_text(instructions_html)
+		instructions_text = instructions_html.strip() or None
+	
+	_PROMPT_CACHE[site] = (version, instructions_text)
+	return instructions_text
 
 
 def get_env_assistant_spec() -> Optional[Dict[str, str]]:
@@ -281,8 +542,22 @@ def get_env_assistant_spec() -> Optional[Dict[str, str]]:
 	Returns:
 		Dict with name/model/instructions keys, or None if override enabled
 	"""
+	site, version = _cache_key()
+	# The spec is read from the environment, so it also depends on its fingerprint
+	fingerprint = _environment_fingerprint()
+	cached = _ENV_SPEC_CACHE.get(site)
+	if cached is not None and cached[0] == version and cached[1] == fingerprint:
+		return cached[2]
+	
+	spec = _build_env_assistant_spec()
+	_ENV_SPEC_CACHE[site] = (version, fingerprint, spec)
+	return spec
+
+
+def _build_env_assistant_spec() -> Optional[Dict[str, str]]:
+	"""Extract the assistant spec from environment variables (uncached)."""
 	# Skip if DocType override is active
-	settings = _get_ai_settings()
+	settings = get_ai_settings()
 	if settings and getattr(settings, "use_settings_override", 0):
 		return None
 	
@@ -308,4 +583,37 @@ def get_env_assistant_spec() -> Optional[Dict[str, str]]:
 	if instructions:
 		spec["instructions"] = instructions
 	
-	return spec
\ No newline at end of file
+	return spec
+
+
+def get_openai_assistant_id() -> Optional[str]:
+	"""Get the OpenAI Assistant ID used for PDF context, if enabled.
+	
+	Returns the assistant_id stored in AI Assistant Settings when
+	enable_pdf_context is on. The value is memoized per site and reused until
+	the settings document changes, so the per-message routing check is a dict
+	lookup instead of a settings read.
+	
+	Returns:
+		Assistant ID string, or None if PDF context is disabled/not configured
+	"""
+	site, version = _cache_key()
+	cached = _ASSISTANT_ID_CACHE.get(site)
+	if cached is not None and cached[0] == version:
+		return cached[1]
+	
+	settings = get_ai_settings()
+	assistant_id = None
+	if settings and getattr(settings, "enable_pdf_context", 0):
+		assistant_id = getattr(settings, "assistant_id", None) or None
+	
+	_ASSISTANT_ID_CACHE[site] = (version, assistant_id)
+	return assistant_id
+
+
+def clear_assistant_id_cache(site: Optional[str] = None) -> None:
+	"""Forget the memoized assistant ID for one site, or for all sites."""
+	if site is None:
+		_ASSISTANT_ID_CACHE.clear()
+	else:
+		_ASSISTANT_ID_CACHE.pop(site, None)
@@ -0,0 +1,76 @@
+"""Typed access to AI Module environment settings.
+
+Every setting read by the agents package is declared once here, with its
+parsing, and read as a module attribute:
+
+	from ai_module.agents import envs
+	if envs.AI_ASSISTANTS_STREAMING:
+		...
+
+Attributes resolve through config.get_environment(), which is cached per
+site and settings version, so each read is a dict lookup plus the parser.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional
+
+from .config import get_environment
+
+_TRUTHY = frozenset({"1", "true", "yes", "on"})
+
+
+def _str(key: str) -> Callable[[], Optional[str]]:
+	def getter() -> Optional[str]:
+		return get_environment().get(key) or None
+	return getter
+
+
+def _flag(key: str) -> Callable[[], bool]:
+	def getter() -> bool:
+		return (get_environment().get(key) or "").strip().lower() in _TRUTHY
+	return getter
+
+
+def _float(key: str, default: Optional[float]) -> Callable[[], Optional[float]]:
+	def getter() -> Optional[float]:
+		value = get_environment().get(key)
+		if not value:
+			return default
+		try:
+			return float(value)
+		except ValueError:
+			return default
+	return getter
+
+
+# Setting name -> resolver
+environment_variables: Dict[str, Callable[[], Any]] = {
+	# OpenAI credentials and endpoint
+	"OPENAI_API_KEY": _str("OPENAI_API_KEY"),
+	"OPENAI_ORG_ID": _str("OPENAI_ORG_ID"),
+	"OPENAI_PROJECT": _str("OPENAI_PROJECT"),
+	"OPENAI_BASE_URL": _str("OPENAI_BASE_URL"),
+
+	# Assistant
+	"AI_ASSISTANT_NAME": _str("AI_ASSISTANT_NAME"),
+	"AI_ASSISTANT_MODEL": _str("AI_ASSISTANT_MODEL"),
+
+	# Assistants API (PDF context)
+	"AI_ASSISTANTS_STREAMING": _flag("AI_ASSISTANTS_STREAMING"),
+	"AI_ASSISTANTS_BATCH_WINDOW_MS": _float("AI_ASSISTANTS_BATCH_WINDOW_MS", 0.0),
+	"AI_SEMANTIC_CACHE": _flag("AI_SEMANTIC_CACHE"),
+	"AI_SEMANTIC_CACHE_THRESHOLD": _float("AI_SEMANTIC_CACHE_THRESHOLD", None),
+}
+
+
+def __getattr__(name: str) -> Any:
+	try:
+		getter = environment_variables[name]
+	except KeyError:
+		raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+	return getter()
+
+
+def __dir__() -> List[str]:
+	return list(environment_variables)
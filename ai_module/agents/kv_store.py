@@ -0,0 +1,160 @@
+"""Durable key-value tables in a per-site SQLite database.
+
+Mappings that must survive restarts and Redis flushes (session -> Responses
+API response id, session -> Assistants thread id) live in
+private/files/ai_kv.sqlite. Each process keeps one autocommit connection per
+site in WAL mode, so workers read while another writes and every update is
+a single-row upsert.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .logger_utils import get_resilient_logger
+from .map_files import get_map_path, read_map_file
+
+KV_DB_FILE = "ai_kv.sqlite"
+
+# Table -> (key column, value column)
+_TABLES: Dict[str, Tuple[str, str]] = {
+	"responses": ("session", "response_id"),
+	"assistants_threads": ("session", "thread_id"),
+}
+
+# Database path -> connection shared by every thread of the process
+_CONNS: Dict[str, sqlite3.Connection] = {}
+_CONNS_LOCK = threading.Lock()
+# Keeps other threads' writes out of a multi-statement transaction on a shared connection
+_WRITE_LOCK = threading.Lock()
+
+
+def _log():
+	"""Get Frappe logger for kv_store module."""
+	return get_resilient_logger("ai_module.kv_store")
+
+
+def get_kv_conn() -> sqlite3.Connection:
+	"""Get the current site's key-value database, creating its tables on first use."""
+	path = get_map_path(KV_DB_FILE)
+	conn = _CONNS.get(path)
+	if conn is not None:
+		return conn
+
+	with _CONNS_LOCK:
+		conn = _CONNS.get(path)
+		if conn is None:
+			os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+			conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+			for table, (key_col, value_col) in _TABLES.items():
+				conn.execute(
+					f"CREATE TABLE IF NOT EXISTS {table} ({key_col} TEXT PRIMARY KEY, {value_col} TEXT NOT NULL)"
+				)
+			conn.execute("CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY, applied_at REAL NOT NULL)")
+			_CONNS[path] = conn
+		return conn
+
+
+def _table(table: str) -> str:
+	"""Validate a table name before it is interpolated into SQL."""
+	if table not in _TABLES:
+		raise KeyError(f"Unknown kv table: {table}")
+	return table
+
+
+def kv_get(table: str, key: str) -> Optional[str]:
+	"""Get the value stored for key, or None."""
+	key_col, value_col = _TABLES[table]
+	row = get_kv_conn().execute(f"SELECT {value_col} FROM {table} WHERE {key_col} = ?", (key,)).fetchone()
+	return row[0] if row else None
+
+
+def kv_set(table: str, key: str, value: str) -> None:
+	"""Store value for key, replacing any previous value."""
+	conn = get_kv_conn()
+	with _WRITE_LOCK:
+		conn.execute(f"INSERT OR REPLACE INTO {_table(table)} VALUES (?, ?)", (key, value))
+
+
+def kv_clear(table: str) -> None:
+	"""Delete every row of a table."""
+	conn = get_kv_conn()
+	with _WRITE_LOCK:
+		conn.execute(f"DELETE FROM {_table(table)}")
+
+
+def _insert_missing(conn: sqlite3.Connection, table: str, rows: Iterable[Tuple[str, str]]) -> None:
+	"""Insert rows whose key is not stored yet (existing rows win)."""
+	conn.executemany(f"INSERT OR IGNORE INTO {_table(table)} VALUES (?, ?)", rows)
+
+
+def _in_transaction(conn: sqlite3.Connection, body: Callable[[], None]) -> None:
+	"""Run body in a write transaction on conn."""
+	with _WRITE_LOCK:
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			body()
+			conn.execute("COMMIT")
+		except BaseException:
+			conn.execute("ROLLBACK")
+			raise
+
+
+def import_json_map(table: str, filename: str) -> int:
+	"""Import a legacy JSON map file from private/files into table.
+
+	Rows already in the table win. The file is renamed to "<name>.migrated"
+	only after the rows are committed, so a failed import is retried later
+	and a wiped table is never refilled from stale data.
+
+	Returns:
+		Number of entries read from the file (0 if it does not exist)
+	"""
+	path = get_map_path(filename)
+	try:
+		legacy = read_map_file(path)
+	except FileNotFoundError:
+		return 0
+
+	rows = [(str(key), str(value)) for key, value in legacy.items() if value]
+	if rows:
+		conn = get_kv_conn()
+		_in_transaction(conn, lambda: _insert_missing(conn, table, rows))
+
+	try:
+		os.replace(path, f"{path}.migrated")
+	except FileNotFoundError:
+		# Another worker imported it concurrently
+		pass
+	_log().info("Imported %s entries from %s into %s", len(rows), filename, table)
+	return len(rows)
+
+
+def run_once(name: str, table: str, rows: Callable[[], Iterable[Tuple[str, str]]]) -> bool:
+	"""Insert rows() into table once per site database, recorded under name.
+
+	Rows already in the table win. The check and the insert share one write
+	transaction, so concurrent workers apply it at most once between them.
+
+	Returns:
+		True if this call applied the migration
+	"""
+	conn = get_kv_conn()
+	applied = False
+
+	def body() -> None:
+		nonlocal applied
+		if conn.execute("SELECT 1 FROM migrations WHERE name = ?", (name,)).fetchone():
+			return
+		_insert_missing(conn, table, rows())
+		conn.execute("INSERT INTO migrations VALUES (?, ?)", (name, time.time()))
+		applied = True
+
+	_in_transaction(conn, body)
+	return applied
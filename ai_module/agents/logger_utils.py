@@ -5,16 +5,24 @@ if file permissions are insufficient.
 """
 
 import logging
-from typing import Any
+import threading
+from typing import Any, Dict, Optional, Tuple
 
 import frappe
 
+# (module name, site) -> logger; Frappe loggers write to site-specific files
+_LOGGER_CACHE: Dict[Tuple[str, Optional[str]], Any] = {}
+
+# Serializes fallback handler setup so concurrent callers attach it only once
+_HANDLER_LOCK = threading.Lock()
+
 
 def get_resilient_logger(module_name: str) -> Any:
 	"""Get a logger that works even with permission issues.
 	
 	Tries to use Frappe's logger system first (which logs to files).
 	Falls back to console/stream logging if file permissions fail.
+	The logger is built once per module and site and then reused.
 	
 	Args:
 		module_name: Logger name (e.g., "ai_module.threads")
@@ -26,6 +34,15 @@ def get_resilient_logger(module_name: str) -> Any:
 		logger = get_resilient_logger("ai_module.threads")
 		logger.info("Processing message...")
 	"""
+	key = (module_name, getattr(frappe.local, "site", None))
+	logger = _LOGGER_CACHE.get(key)
+	if logger is None:
+		logger = _LOGGER_CACHE[key] = _build_logger(module_name)
+	return logger
+
+
+def _build_logger(module_name: str) -> Any:
+	"""Create the Frappe logger, or a console logger if log files are not writable."""
 	try:
 		# Try Frappe logger (logs to files in sites/<site>/logs/)
 		return frappe.logger(module_name)
@@ -33,22 +50,24 @@ def get_resilient_logger(module_name: str) -> Any:
 		# Fallback to console logger if file access fails
 		logger = logging.getLogger(module_name)
 		
-		# Only add handler if not already present
-		if not logger.handlers:
-			handler = logging.StreamHandler()
-			formatter = logging.Formatter(
-				'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-				datefmt='%Y-%m-%d %H:%M:%S'
-			)
-			handler.setFormatter(formatter)
-			logger.addHandler(handler)
-			logger.setLevel(logging.INFO)
-			
-			# Log the fallback (only once)
-			logger.warning(
-				f"Using console logger due to file permission error: {e}. "
-				f"Logs will not be saved to file."
-			)
+		# Only add handler if not already present (the lock keeps concurrent
+		# callers from each attaching one, which would duplicate every line)
+		with _HANDLER_LOCK:
+			if not getattr(logger, "_ai_module_configured", False):
+				handler = logging.StreamHandler()
+				formatter = logging.Formatter(
+					'%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+					datefmt='%Y-%m-%d %H:%M:%S'
+				)
+				handler.setFormatter(formatter)
+				logger.addHandler(handler)
+				logger.setLevel(logging.INFO)
+				logger._ai_module_configured = True
+				
+				# Log the fallback (only once)
+				logger.warning(
+					f"Using console logger due to file permission error: {e}. "
+					f"Logs will not be saved to file."
+				)
 		
 		return logger
-
@@ -0,0 +1,160 @@
+"""JSON map files stored in the site's private files.
+
+Small phone/session keyed maps (threads, languages, profiles, handoffs,
+message history) are kept as JSON files under private/files. Parsed maps
+are cached per path and reused while the file's mtime and size are
+unchanged; writes go through a temp file and rename, so readers in other
+workers never see a truncated file.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import frappe
+
+try:
+	import orjson
+except ImportError:  # optional, faster JSON for the map files
+	orjson = None
+
+from .logger_utils import get_resilient_logger
+
+# Parsed map files: path -> ((inode, mtime_ns, size), mapping); re-read only when the file changes.
+# Every write replaces the file with a new inode, so a same-size rewrite within
+# one mtime tick is still noticed.
+_MAP_FILE_CACHE: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
+
+# (site, filename) -> absolute map file path
+_MAP_PATHS: Dict[Tuple[Optional[str], str], str] = {}
+
+
+def _log():
+	"""Get Frappe logger for map_files module."""
+	return get_resilient_logger("ai_module.map_files")
+
+
+def get_map_path(filename: str) -> str:
+	"""Get the full path for a JSON map file (resolved once per site)."""
+	key = (getattr(frappe.local, "site", None), filename)
+	path = _MAP_PATHS.get(key)
+	if path is None:
+		path = _MAP_PATHS[key] = frappe.utils.get_site_path("private", "files", filename)
+	return path
+
+
+def _temp_path(filename: str) -> str:
+	"""Get the fallback location used when private/files is not writable."""
+	return os.path.join(tempfile.gettempdir(), f"ai_module_{filename}")
+
+
+def _file_version(st: os.stat_result) -> Tuple[int, int, int]:
+	"""Identify one version of a file: (inode, mtime_ns, size)."""
+	return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def parse_map_file(path: str) -> Dict[str, Any]:
+	"""Return the cached parse of a JSON map file; empty files yield an empty dict.
+
+	The returned dict is shared and must not be modified. It is the same
+	object until the file changes, so callers may key derived data on it.
+	"""
+	version = _file_version(os.stat(path))
+	cached = _MAP_FILE_CACHE.get(path)
+	if cached is not None and cached[0] == version:
+		return cached[1]
+
+	with open(path, "rb") as f:
+		data = f.read().strip()
+	if not data:
+		mapping = {}
+	elif orjson is not None:
+		mapping = orjson.loads(data)
+	else:
+		mapping = json.loads(data)
+
+	_MAP_FILE_CACHE[path] = (version, mapping)
+	return mapping
+
+
+def read_map_file(path: str) -> Dict[str, Any]:
+	"""Read a JSON map file as a shallow copy callers may modify and save."""
+	return dict(parse_map_file(path))
+
+
+def write_map_file(path: str, mapping: Dict[str, Any]) -> None:
+	"""Write a JSON map file compactly (the files are machine-read only) and atomically.
+
+	The written map becomes the cached parse of path, so the next load in
+	this process does not re-read it.
+	"""
+	if orjson is not None:
+		data = orjson.dumps(mapping)
+	else:
+		data = json.dumps(mapping, separators=(",", ":")).encode("utf-8")
+	_MAP_FILE_CACHE.pop(path, None)
+
+	tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	try:
+		with open(tmp_path, "wb") as f:
+			f.write(data)
+			f.flush()
+			# The rename keeps inode and mtime, so this identifies the file we
+			# publish even if another writer replaces it right after
+			version = _file_version(os.fstat(f.fileno()))
+		os.replace(tmp_path, path)
+	except BaseException:
+		try:
+			os.unlink(tmp_path)
+		except OSError:
+			pass
+		raise
+
+	_MAP_FILE_CACHE[path] = (version, dict(mapping))
+
+
+def load_json_map(filename: str) -> Dict[str, Any]:
+	"""Load a JSON map from file. Returns empty dict if file doesn't exist."""
+	try:
+		path = get_map_path(filename)
+		if not os.path.exists(path):
+			return {}
+
+		return read_map_file(path)
+	except Exception as e:
+		_log().error(f"Failed to load JSON map {filename}: {e}")
+		# Try fallback from temp location
+		try:
+			temp_path = _temp_path(filename)
+			if os.path.exists(temp_path):
+				return read_map_file(temp_path)
+		except Exception as temp_e:
+			_log().error(f"Failed to load {filename} even from temp location: {temp_e}")
+		return {}
+
+
+def save_json_map(filename: str, mapping: Dict[str, Any]) -> None:
+	"""Save a JSON map to file. Logs errors but doesn't raise."""
+	try:
+		path = get_map_path(filename)
+		# Ensure directory exists with proper permissions
+		os.makedirs(os.path.dirname(path), mode=0o755, exist_ok=True)
+
+		write_map_file(path, mapping)
+
+		# Set file permissions
+		os.chmod(path, 0o644)
+
+	except Exception as e:
+		_log().error(f"Failed to save JSON map {filename}: {e}")
+		# Fallback: try to save in a temporary location
+		try:
+			temp_path = _temp_path(filename)
+			write_map_file(temp_path, mapping)
+			_log().info(f"Saved {filename} to temporary location: {temp_path}")
+		except Exception as temp_e:
+			_log().error(f"Failed to save {filename} even to temp location: {temp_e}")
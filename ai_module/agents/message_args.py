@@ -0,0 +1,22 @@
+"""The "[args]" context block appended to channel messages.
+
+Integrations send the user's text followed by "\n\n[args]: {json}" with
+per-message context for the agent (reference document, language, contact
+profile, message metadata); see integrations.whatsapp._compose_ai_message.
+The JSON is serialized with escaped newlines, so the marker cannot occur
+inside it and the last occurrence is always the real block.
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+ARGS_MARKER = "\n\n[args]: "
+
+
+def split_args(message: str) -> Tuple[str, Optional[str]]:
+	"""Split a message into (user text, args block including its marker or None)."""
+	index = message.rfind(ARGS_MARKER)
+	if index < 0:
+		return message, None
+	return message[:index], message[index:]
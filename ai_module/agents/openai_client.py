@@ -0,0 +1,164 @@
+"""Shared OpenAI client for AI Module.
+
+Constructing an OpenAI client builds an httpx connection pool and an SSL
+context (which loads CA certificates from disk). Creating one per call also
+throws away keep-alive connections, so every request pays a fresh TCP+TLS
+handshake. This module keeps one client per credential set and reuses it
+across requests and threads (httpx.Client is thread-safe).
+"""
+
+from __future__ import annotations
+
+import atexit
+import importlib.util
+import os
+import ssl
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+	import httpx
+	from openai import OpenAI
+
+# Connection pool sizing for the shared httpx client
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY_SECONDS = 30.0
+
+# Per-request limits applied to every shared client
+REQUEST_TIMEOUT_SECONDS = 120.0
+CONNECT_TIMEOUT_SECONDS = 10.0
+MAX_RETRIES = 2
+
+# HTTP/2 lets concurrent requests (e.g. run polls) share one connection;
+# httpx only supports it when the optional h2 package is installed
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# SSL context shared by every client (built once per process)
+_SSL_CONTEXT = ssl.create_default_context()
+
+# (api_key, base_url, organization, project) -> client
+_CLIENTS: Dict[Tuple[Optional[str], ...], "OpenAI"] = {}
+_HTTP_CLIENTS: Dict[Tuple[Optional[str], ...], "httpx.Client"] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# Client keys whose connection pool has already been warmed
+_WARMED: Set[Tuple[Optional[str], ...]] = set()
+
+
+def _client_key(api_key: str) -> Tuple[Optional[str], ...]:
+	"""Build the cache key for a client.
+
+	The SDK reads base URL, organization and project from os.environ at
+	construction time (set by apply_environment), so they are part of the key.
+	"""
+	return (
+		api_key,
+		os.environ.get("OPENAI_BASE_URL") or None,
+		os.environ.get("OPENAI_ORG_ID") or None,
+		os.environ.get("OPENAI_PROJECT") or None,
+	)
+
+
+def get_openai_client(api_key: str) -> "OpenAI":
+	"""Get a shared OpenAI client for the given API key.
+
+	The first call for a credential set builds the client; subsequent calls
+	return the same instance so its connection pool and TLS sessions are reused.
+
+	Args:
+		api_key: OpenAI API key
+
+	Returns:
+		OpenAI client instance
+	"""
+	key = _client_key(api_key)
+	client = _CLIENTS.get(key)
+	if client is not None:
+		return client
+
+	with _CLIENTS_LOCK:
+		client = _CLIENTS.get(key)
+		if client is None:
+			import httpx
+			from openai import OpenAI
+
+			http_client = httpx.Client(
+				limits=httpx.Limits(
+					max_connections=MAX_CONNECTIONS,
+					max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+					keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS,
+				),
+				timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+				verify=_SSL_CONTEXT,
+				http2=HTTP2_ENABLED,
+			)
+			client = OpenAI(
+				api_key=api_key,
+				http_client=http_client,
+				timeout=httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+				max_retries=MAX_RETRIES,
+			)
+			_CLIENTS[key] = client
+			_HTTP_CLIENTS[key] = http_client
+		return client
+
+
+def warm_openai_client(api_key: str) -> None:
+	"""Open a pooled connection to the API in the background.
+
+	Issues a lightweight HEAD request against the client's base URL from a
+	daemon thread so the TCP+TLS handshake happens off the request path; the
+	next real API call reuses the kept-alive connection. Runs at most once per
+	credential set and never raises.
+
+	Args:
+		api_key: OpenAI API key
+	"""
+	key = _client_key(api_key)
+	with _CLIENTS_LOCK:
+		if key in _WARMED:
+			return
+		_WARMED.add(key)
+
+	client = get_openai_client(api_key)
+	http_client = _HTTP_CLIENTS[key]
+
+	def _warm() -> None:
+		try:
+			http_client.head(str(client.base_url))
+		except Exception:
+			pass
+
+	threading.Thread(target=_warm, name="ai-module-openai-warmup", daemon=True).start()
+
+
+def reset_openai_clients() -> None:
+	"""Forget all shared clients so the next call builds fresh ones.
+	
+	Used when credentials or endpoint settings change. Existing clients are
+	not closed because requests on other threads may still be using them;
+	they are released once those references go away.
+	"""
+	with _CLIENTS_LOCK:
+		_CLIENTS.clear()
+		_HTTP_CLIENTS.clear()
+		_WARMED.clear()
+
+
+def close_openai_clients() -> None:
+	"""Close all shared clients and release their connection pools."""
+	with _CLIENTS_LOCK:
+		clients = list(_CLIENTS.values())
+		_CLIENTS.clear()
+		_HTTP_CLIENTS.clear()
+		_WARMED.clear()
+
+	for client in clients:
+		try:
+			client.close()
+		except Exception:
+			pass
+
+
+atexit.register(close_openai_clients)
@@ -11,7 +11,8 @@ and capabilities.
 
 from __future__ import annotations
 
-from typing import Callable, Dict, List, Optional
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
 
 from agents import Agent, function_tool
 
@@ -20,6 +21,13 @@ from agents import Agent, function_tool
 _TOOL_REGISTRY: Dict[str, Callable] = {}
 _AGENT_REGISTRY: Dict[str, Agent] = {}
 
+# Tool name -> original function, so re-registering it skips re-wrapping
+_TOOL_SOURCES: Dict[str, Callable] = {}
+
+# Sorted name snapshots for list_tools()/list_agents(); reset on registration
+_TOOL_NAMES: Optional[Tuple[str, ...]] = None
+_AGENT_NAMES: Optional[Tuple[str, ...]] = None
+
 
 def register_tool(func: Callable, name: Optional[str] = None) -> Callable:
 	"""Register a function as an AI-callable tool.
@@ -28,6 +36,10 @@ def register_tool(func: Callable, name: Optional[str] = None) -> Callable:
 	with the AI agent's tool-calling mechanism. The registered tool can then
 	be used by AI agents to perform specific actions.
 	
+	Registering the same function under the same name again (e.g. from
+	concurrent bootstraps) returns the existing wrapper; a different
+	function replaces it.
+	
 	Args:
 		func: The function to register as a tool
 		name: Optional custom name for the tool (defaults to func.__name__)
@@ -52,9 +64,19 @@ def register_tool(func: Callable, name: Optional[str] = None) -> Callable:
 	if not tool_name:
 		raise ValueError("register_tool: name cannot be empty")
 	
+	if _TOOL_SOURCES.get(tool_name) is func:
+		existing = _TOOL_REGISTRY.get(tool_name)
+		if existing is not None:
+			return existing
+	
+	global _TOOL_NAMES
+	
 	# Wrap with function_tool decorator and register
+	tool_name = sys.intern(tool_name)
 	wrapped_tool = function_tool(func)
 	_TOOL_REGISTRY[tool_name] = wrapped_tool
+	_TOOL_SOURCES[tool_name] = func
+	_TOOL_NAMES = None
 	
 	return wrapped_tool
 
@@ -65,7 +87,12 @@ def list_tools() -> List[str]:
 	Returns:
 		Sorted list of tool names
 	"""
-	return sorted(_TOOL_REGISTRY.keys())
+	global _TOOL_NAMES
+	
+	names = _TOOL_NAMES
+	if names is None:
+		names = _TOOL_NAMES = tuple(sorted(_TOOL_REGISTRY))
+	return list(names)
 
 
 def get_tool(name: str) -> Callable:
@@ -84,10 +111,10 @@ def get_tool(name: str) -> Callable:
 	if not tool_name:
 		raise KeyError("get_tool: name cannot be empty")
 	
-	if tool_name not in _TOOL_REGISTRY:
-		raise KeyError(f"Tool not registered: {tool_name}")
-	
-	return _TOOL_REGISTRY[tool_name]
+	try:
+		return _TOOL_REGISTRY[tool_name]
+	except KeyError:
+		raise KeyError(f"Tool not registered: {tool_name}") from None
 
 
 def register_agent(agent: Agent, name: Optional[str] = None) -> Agent:
@@ -115,7 +142,10 @@ def register_agent(agent: Agent, name: Optional[str] = None) -> Agent:
 	if not agent_name:
 		raise ValueError("register_agent: name cannot be empty")
 	
-	_AGENT_REGISTRY[agent_name] = agent
+	global _AGENT_NAMES
+	
+	_AGENT_REGISTRY[sys.intern(agent_name)] = agent
+	_AGENT_NAMES = None
 	return agent
 
 
@@ -135,10 +165,10 @@ def get_agent(name: str) -> Agent:
 	if not agent_name:
 		raise KeyError("get_agent: name cannot be empty")
 	
-	if agent_name not in _AGENT_REGISTRY:
-		raise KeyError(f"Agent not registered: {agent_name}")
-	
-	return _AGENT_REGISTRY[agent_name]
+	try:
+		return _AGENT_REGISTRY[agent_name]
+	except KeyError:
+		raise KeyError(f"Agent not registered: {agent_name}") from None
 
 
 def list_agents() -> List[str]:
@@ -147,4 +177,9 @@ def list_agents() -> List[str]:
 	Returns:
 		Sorted list of agent names
 	"""
-	return sorted(_AGENT_REGISTRY.keys()) 
\ No newline at end of file
+	global _AGENT_NAMES
+	
+	names = _AGENT_NAMES
+	if names is None:
+		names = _AGENT_NAMES = tuple(sorted(_AGENT_REGISTRY))
+	return list(names) 
\ No newline at end of file
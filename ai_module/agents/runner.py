@@ -12,14 +12,22 @@ previous_response_id for maintaining conversation state across multiple turns.
 
 from __future__ import annotations
 
+from contextvars import ContextVar
 from typing import Any, Dict, Optional, Union
 
 import frappe
 from agents import Agent
 
+from .assistants_api import run_with_assistants_api
 from .bootstrap import initialize
+from .config import get_openai_assistant_id
 from .logger_utils import get_resilient_logger
 from .registry import get_agent as _get_registered_agent
+from .threads import run_with_responses_api
+
+
+# Set while run_agent() is executing in the current thread/context
+_TOOL_CALL_MODE: ContextVar[bool] = ContextVar("ai_tool_call_mode", default=False)
 
 
 def _log():
@@ -27,6 +35,11 @@ def _log():
 	return get_resilient_logger("ai_module.runner")
 
 
+def is_tool_call_mode() -> bool:
+	"""Check if the current context is executing an agent run (run_agent)."""
+	return _TOOL_CALL_MODE.get()
+
+
 def _resolve_agent(agent_or_name: Union[str, Agent], model: Optional[str]) -> Agent:
 	"""Resolve agent from name or instance and optionally override model.
 	
@@ -71,29 +84,24 @@ def _run_via_responses_api(input_text: str, session_id: Optional[str]) -> Dict[s
 	Returns:
 		Dict with final_output, thread_id (session), and model
 	"""
-	# Check if PDF context is enabled
+	# Check if PDF context is enabled (assistant ID is memoized per site)
 	try:
-		settings = frappe.get_single("AI Assistant Settings")
-		use_pdf_context = settings.enable_pdf_context and settings.assistant_id
+		assistant_id = get_openai_assistant_id()
 	except Exception:
-		use_pdf_context = False
+		assistant_id = None
 	
-	if use_pdf_context:
+	if assistant_id:
 		# Use Assistants API with file_search for PDF-based RAG
-		from .assistants_api import run_with_assistants_api
-		
-		_log().info(f"Running with Assistants API (PDF context) session={session_id or '<new>'}")
+		_log().info("Running with Assistants API (PDF context) session=%s", session_id or "<new>")
 		
 		return run_with_assistants_api(
 			message=input_text,
-			assistant_id=settings.assistant_id,
+			assistant_id=assistant_id,
 			session_id=session_id
 		)
 	else:
 		# Use modern Responses API (default)
-		from .threads import run_with_responses_api
-		
-		_log().info(f"Running with Responses API session={session_id or '<new>'}")
+		_log().info("Running with Responses API session=%s", session_id or "<new>")
 		
 		return run_with_responses_api(
 			message=input_text,
@@ -138,11 +146,25 @@ def run_agent(
 		print(result["final_output"])  # AI's response
 		print(result["thread_id"])     # For conversation continuity
 	"""
-	import os
+	output = _execute(input_text, session_id)
 	
-	# Set environment variable to indicate we're in AI tool call mode
-	# This prevents log files from being created during tool calls
-	os.environ['AI_TOOL_CALL_MODE'] = '1'
+	# Add agent name to output
+	agent_name = agent_or_name if type(agent_or_name) is str else getattr(agent_or_name, "name", str(agent_or_name))
+	
+	# The API helpers return a fresh dict per call, so annotate it in place
+	output["agent_name"] = agent_name
+	return output
+
+
+def _execute(input_text: str, session_id: Optional[str]) -> Dict[str, Any]:
+	"""Initialize, validate input and run the message in AI tool call mode.
+	
+	Shared by run_agent() and run_agent_sync(); returns the raw API output.
+	"""
+	# Mark this context as AI tool call mode (see is_tool_call_mode). A
+	# context variable, unlike os.environ, does not leak into concurrent
+	# requests served by other threads of the same process.
+	token = _TOOL_CALL_MODE.set(True)
 	
 	try:
 		# Initialize agent system (registers tools, etc.)
@@ -153,17 +175,10 @@ def run_agent(
 			raise ValueError("input_text must be a non-empty string")
 		
 		# Execute via modern Responses API
-		output = _run_via_responses_api(input_text, session_id)
-		
-		# Add agent name to output
-		agent_name = agent_or_name.name if isinstance(agent_or_name, Agent) else str(agent_or_name)
-		
-		return {**output, "agent_name": agent_name}
+		return _run_via_responses_api(input_text, session_id)
 	
 	finally:
-		# Clean up environment variable
-		if 'AI_TOOL_CALL_MODE' in os.environ:
-			del os.environ['AI_TOOL_CALL_MODE']
+		_TOOL_CALL_MODE.reset(token)
 
 
 def run_agent_sync(
@@ -196,11 +211,5 @@ def run_agent_sync(
 		response = run_agent_sync("crm_ai", "What is the weather?")
 		print(response)  # Just the AI's answer
 	"""
-	result = run_agent(
-		agent_or_name=agent_or_name,
-		input_text=input_text,
-		session_id=session_id,
-		model=model,
-		**runner_kwargs,
-	)
-	return result["final_output"] 
\ No newline at end of file
+	# Same execution as run_agent(), without building the metadata
+	return _execute(input_text, session_id)["final_output"] 
\ No newline at end of file
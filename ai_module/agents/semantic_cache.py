@@ -0,0 +1,145 @@
+"""Semantic response cache for the Assistants API (PDF knowledge base) path.
+
+Answers to knowledge-base questions rarely depend on the conversation, so a
+new question that is semantically close to one answered recently can reuse
+that answer and skip thread/run creation and file_search entirely.
+
+The cache is opt-in (AI_SEMANTIC_CACHE). Entries are stored per site and
+scope in Redis lists as shortened, normalized embeddings of the user's text
+(the "[args]" context block is never embedded), and compared by cosine
+similarity with a linear scan over at most MAX_ENTRIES vectors. Messages
+that carry per-user context are cached per session, others per assistant.
+Answers produced with tool calls are never cached.
+"""
+
+from __future__ import annotations
+
+import math
+import operator
+import pickle
+import time
+from array import array
+from typing import TYPE_CHECKING, Optional
+
+import frappe
+
+from . import envs
+from .logger_utils import get_resilient_logger
+from .message_args import split_args
+
+if TYPE_CHECKING:
+	from openai import OpenAI
+
+# Embedding model and shortened dimension used for cache keys
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 256
+
+# Minimum cosine similarity for a hit (overridable via AI_SEMANTIC_CACHE_THRESHOLD)
+DEFAULT_THRESHOLD = 0.92
+# Entry lifetime and per-assistant capacity
+TTL_SECONDS = 24 * 3600
+MAX_ENTRIES = 256
+# Short messages ("sì", "ok grazie") depend on context and are never cached
+MIN_MESSAGE_CHARS = 24
+
+# Prefix of the Redis lists (site-scoped) holding each scope's entries, newest first
+_CACHE_KEY = "ai_semantic_cache"
+
+
+def _log():
+	"""Get Frappe logger for semantic_cache module."""
+	return get_resilient_logger("ai_module.semantic_cache")
+
+
+def is_enabled() -> bool:
+	"""Check if the semantic cache is enabled (AI_SEMANTIC_CACHE)."""
+	return envs.AI_SEMANTIC_CACHE
+
+
+def cache_scope(assistant_id: str, message: str, session_id: Optional[str]) -> Optional[str]:
+	"""Return the scope a message is cached under, or None if it is not cacheable.
+	
+	Commands and short texts are never cached. A message with an "[args]"
+	block carries per-user context (contact profile, language, reference
+	document) that can shape the answer, so it is cached per session;
+	without a session it is not cached at all.
+	"""
+	text, args = split_args(message or "")
+	text = text.strip()
+	if len(text) < MIN_MESSAGE_CHARS or text.startswith("/"):
+		return None
+	if args is None:
+		return assistant_id
+	if not session_id:
+		return None
+	return f"{assistant_id}:{session_id}"
+
+
+def _threshold() -> float:
+	threshold = envs.AI_SEMANTIC_CACHE_THRESHOLD
+	return DEFAULT_THRESHOLD if threshold is None else threshold
+
+
+def embed(client: "OpenAI", message: str) -> array:
+	"""Embed a message's user text and return it as a normalized float32 vector."""
+	text, _args = split_args(message)
+	response = client.embeddings.create(
+		model=EMBEDDING_MODEL,
+		input=" ".join(text.split()).lower(),
+		dimensions=EMBEDDING_DIMENSIONS,
+	)
+	vector = response.data[0].embedding
+	norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+	return array("f", (x / norm for x in vector))
+
+
+def _key(scope: str) -> str:
+	return f"{_CACHE_KEY}:{scope}"
+
+
+def lookup(scope: str, vector: array) -> Optional[str]:
+	"""Return the cached answer closest to vector, if similar enough and fresh."""
+	now = time.time()
+	best_score = _threshold()
+	best_answer = None
+
+	for item in frappe.cache().lrange(_key(scope), 0, -1) or []:
+		ts, vector_bytes, answer = pickle.loads(item)
+		if now - ts > TTL_SECONDS:
+			# Entries are newest first, so the rest are expired too
+			break
+		score = sum(map(operator.mul, vector, array("f", vector_bytes)))
+		if score >= best_score:
+			best_score = score
+			best_answer = answer
+
+	if best_answer is not None:
+		_log().info("Semantic cache hit: scope=%s score=%.3f", scope, best_score)
+	return best_answer
+
+
+def store(scope: str, vector: array, answer: str) -> None:
+	"""Add an answer to the cache, keeping the newest MAX_ENTRIES of its scope.
+	
+	The push, trim and expiry run in one Redis transaction, so concurrent
+	stores never overwrite each other's entries.
+	"""
+	cache = frappe.cache()
+	key = cache.make_key(_key(scope))
+	pipe = cache.pipeline(transaction=True)
+	pipe.lpush(key, pickle.dumps((time.time(), vector.tobytes(), answer)))
+	pipe.ltrim(key, 0, MAX_ENTRIES - 1)
+	pipe.expire(key, TTL_SECONDS)
+	pipe.execute()
+
+
+def clear(assistant_id: Optional[str] = None) -> None:
+	"""Drop cached answers for one assistant (all its sessions), or for all assistants on the site."""
+	cache = frappe.cache()
+	if assistant_id:
+		cache.delete_value(_key(assistant_id))
+		cache.delete_keys(_key(f"{assistant_id}:"))
+	else:
+		cache.delete_keys(f"{_CACHE_KEY}:")
+		# Hash used by earlier versions of the cache
+		cache.delete_value(_CACHE_KEY)
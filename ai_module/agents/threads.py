@@ -1,14 +1,29 @@
 from __future__ import annotations
 
 import json
-import os
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, FrozenSet, List, Mapping, Optional, Sequence, Set, Tuple
 
 import frappe
-from openai import OpenAI, BadRequestError
 
+try:
+	import orjson
+except ImportError:  # optional, faster JSON for tool arguments and results
+	orjson = None
+
+if TYPE_CHECKING:
+	from openai import OpenAI
+
+from . import kv_store
 from .logger_utils import get_resilient_logger
+from .map_files import (
+	get_map_path as _get_map_path,
+	load_json_map as _load_json_map,
+	parse_map_file as _parse_map_file,
+	save_json_map as _save_json_map,
+)
+from .openai_client import get_openai_client
+from .tool_executor import execute_tool_calls
 
 # Constants
 DEFAULT_TIMEOUT_SECONDS = 120
@@ -24,77 +39,44 @@ FUNCTION_CALL = "function_call"  # Actual type used by Responses API for tool ca
 
 # File paths
 THREAD_MAP_FILE = "ai_whatsapp_threads.json"
-RESPONSES_MAP_FILE = "ai_whatsapp_responses.json"
+RESPONSES_MAP_FILE = "ai_whatsapp_responses.json"  # legacy, imported into the kv store
 MESSAGES_MAP_FILE = "ai_whatsapp_messages.json"
 
+# kv store table: session -> last Responses API response id
+RESPONSES_TABLE = "responses"
+
+# Tool argument keys never accepted from the model (phone comes from the thread)
+_UNSAFE_PHONE_KEYS = frozenset({"phone", "mobile", "mobile_no"})
+
+# Names of tools that receive phone_from (resolved once from the tools package)
+_PHONE_CONSUMING_TOOLS: Optional[FrozenSet[str]] = None
+
 
 def _log():
 	"""Get Frappe logger for threads module."""
 	return get_resilient_logger("ai_module.threads")
 
 
-def _get_map_path(filename: str) -> str:
-	"""Get the full path for a JSON map file."""
-	return frappe.utils.get_site_path("private", "files", filename)
+def _loads(data: Any) -> Any:
+	"""Parse JSON from str or bytes (orjson when installed)."""
+	if orjson is not None:
+		return orjson.loads(data)
+	return json.loads(data)
 
 
-def _load_json_map(filename: str) -> Dict[str, Any]:
-	"""Load a JSON map from file. Returns empty dict if file doesn't exist."""
-	try:
-		path = _get_map_path(filename)
-		if not os.path.exists(path):
-			return {}
-		
-		with open(path, "r", encoding="utf-8") as f:
-			data = f.read().strip()
-			if not data:
-				return {}
-			return json.loads(data)
-	except Exception as e:
-		_log().error(f"Failed to load JSON map {filename}: {e}")
-		# Try fallback from temp location
+def _dumps(obj: Any) -> str:
+	"""Serialize to compact JSON text; unknown types are stringified."""
+	if orjson is not None:
 		try:
-			import tempfile
-			temp_dir = tempfile.gettempdir()
-			temp_path = os.path.join(temp_dir, f"ai_module_{filename}")
-			if os.path.exists(temp_path):
-				with open(temp_path, "r", encoding="utf-8") as f:
-					data = f.read().strip()
-					if not data:
-						return {}
-					return json.loads(data)
-		except Exception as temp_e:
-			_log().debug(f"Fallback load also failed for {filename}: {temp_e}")
-		return {}
-
-
-def _save_json_map(filename: str, mapping: Dict[str, Any]) -> None:
-	"""Save a JSON map to file. Logs errors but doesn't raise."""
-	try:
-		path = _get_map_path(filename)
-		# Ensure directory exists with proper permissions
-		dir_path = os.path.dirname(path)
-		os.makedirs(dir_path, mode=0o755, exist_ok=True)
-		
-		# Write file with proper permissions
-		with open(path, "w", encoding="utf-8") as f:
-			json.dump(mapping, f, indent=2)
-		
-		# Set file permissions
-		os.chmod(path, 0o644)
-		
-	except Exception as e:
-		_log().error(f"Failed to save JSON map {filename}: {e}")
-		# Fallback: try to save in a temporary location
-		try:
-			import tempfile
-			temp_dir = tempfile.gettempdir()
-			temp_path = os.path.join(temp_dir, f"ai_module_{filename}")
-			with open(temp_path, "w", encoding="utf-8") as f:
-				json.dump(mapping, f, indent=2)
-			_log().info(f"Saved {filename} to temporary location: {temp_path}")
-		except Exception as temp_e:
-			_log().error(f"Failed to save {filename} even to temp location: {temp_e}")
+			return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+		except TypeError:
+			# e.g. integers beyond 64 bits, which only the stdlib encoder handles
+			pass
+	return json.dumps(obj, default=str, separators=(",", ":"))
+
+
+# Thread map path -> (parsed forward map, session id -> phone)
+_THREAD_REVERSE_INDEX: Dict[str, Tuple[Dict[str, Any], Dict[str, str]]] = {}
 
 
 def _ensure_thread_id(session_id: Optional[str]) -> str:
@@ -104,8 +86,36 @@ def _ensure_thread_id(session_id: Optional[str]) -> str:
 	return f"session_{int(time.time() * 1000)}"
 
 
+def _thread_reverse_index() -> Dict[str, str]:
+	"""Get the session id -> phone index for the thread map.
+	
+	Built once per parse of the map file, so it is rebuilt only when the file
+	changes. Raises OSError if the file is missing or unreadable.
+	"""
+	path = _get_map_path(THREAD_MAP_FILE)
+	forward = _parse_map_file(path)
+	cached = _THREAD_REVERSE_INDEX.get(path)
+	if cached is not None and cached[0] is forward:
+		return cached[1]
+	
+	reverse: Dict[str, str] = {}
+	for phone, sid in forward.items():
+		# First match wins, as with a scan of the map
+		reverse.setdefault(sid, str(phone))
+	_THREAD_REVERSE_INDEX[path] = (forward, reverse)
+	return reverse
+
+
 def _lookup_phone_from_thread(thread_id: str) -> Optional[str]:
 	"""Best-effort reverse lookup: find phone by session id from persisted map."""
+	try:
+		return _thread_reverse_index().get(thread_id)
+	except FileNotFoundError:
+		return None
+	except Exception:
+		pass
+	
+	# Slow path (unreadable map): scan whatever _load_json_map can recover
 	mapping = _load_json_map(THREAD_MAP_FILE)
 	for phone, sid in mapping.items():
 		if sid == thread_id:
@@ -113,13 +123,13 @@ def _lookup_phone_from_thread(thread_id: str) -> Optional[str]:
 	return None
 
 
-def _coerce_tool_for_responses(tool: Dict[str, Any]) -> Dict[str, Any]:
+def _coerce_tool_for_responses(tool: Mapping[str, Any]) -> Dict[str, Any]:
 	"""Convert a single Assistants-style tool to Responses format."""
-	if not isinstance(tool, dict):
+	if not isinstance(tool, Mapping):
 		return tool
 	
 	if (tool.get("type") or "").lower() != "function":
-		return tool
+		return dict(tool)
 	
 	fn = tool.get("function") or {}
 	name = (fn.get("name") or "").strip()
@@ -134,12 +144,13 @@ def _coerce_tool_for_responses(tool: Dict[str, Any]) -> Dict[str, Any]:
 	}
 
 
-def _coerce_tools_for_responses(tools: Optional[List]) -> List[Dict[str, Any]]:
+def _coerce_tools_for_responses(tools: Optional[Sequence[Mapping[str, Any]]]) -> List[Dict[str, Any]]:
 	"""Convert Assistants-style function tool schemas to Responses format.
 
 	Accepts items like {"type":"function","function":{name,description,parameters}}
 	and returns {"type":"function","name":name,"description":...,"parameters":...}
-	Other tool definitions are passed through unchanged.
+	Other tool definitions are copied into plain dicts (the cached schemas
+	are read-only mappings, which the SDK cannot serialize).
 	"""
 	if not tools:
 		return []
@@ -194,14 +205,43 @@ def _extract_tool_uses_and_text(resp: Any) -> Dict[str, Any]:
 	return {"tool_uses": tool_uses, "texts": texts}
 
 
-def _load_responses_map() -> Dict[str, str]:
-	"""Load session -> response_id mapping."""
-	return _load_json_map(RESPONSES_MAP_FILE)
+# Sites whose legacy JSON responses map was checked by this process
+_RESPONSES_IMPORT_CHECKED: Set[str] = set()
+
 
+def _import_legacy_responses() -> None:
+	"""Import the legacy JSON responses map into the kv store (once per site and process)."""
+	site = getattr(frappe.local, "site", None)
+	if site in _RESPONSES_IMPORT_CHECKED:
+		return
+	_RESPONSES_IMPORT_CHECKED.add(site)
+	try:
+		kv_store.import_json_map(RESPONSES_TABLE, RESPONSES_MAP_FILE)
+	except Exception as e:
+		_log().error("Failed to import %s: %s", RESPONSES_MAP_FILE, e)
+
+
+def _get_response_id(session_id: str) -> Optional[str]:
+	"""Get the last response_id of a session. Logs errors but doesn't raise."""
+	_import_legacy_responses()
+	try:
+		return kv_store.kv_get(RESPONSES_TABLE, session_id)
+	except Exception as e:
+		_log().error("Failed to load response_id for %s: %s", session_id, e)
+		return None
 
-def _save_responses_map(mapping: Dict[str, str]) -> None:
-	"""Save session -> response_id mapping."""
-	_save_json_map(RESPONSES_MAP_FILE, mapping)
+
+def _set_response_id(session_id: str, response_id: str) -> None:
+	"""Store the last response_id of a session. Logs errors but doesn't raise."""
+	try:
+		kv_store.kv_set(RESPONSES_TABLE, session_id, response_id)
+	except Exception as e:
+		_log().error("Failed to save response_id for %s: %s", session_id, e)
+
+
+def _clear_response_ids() -> None:
+	"""Forget every session's response_id (conversations restart from scratch)."""
+	kv_store.kv_clear(RESPONSES_TABLE)
 
 
 def _load_messages_map() -> Dict[str, Any]:
@@ -228,16 +268,14 @@ def _add_message_to_history(phone_number: str, role: str, content: str, timestam
 	
 	messages_map = _load_messages_map()
 	
-	if phone_number not in messages_map:
-		messages_map[phone_number] = []
-	
 	message_entry = {
 		"role": role,
 		"content": content,
 		"timestamp": timestamp
 	}
 	
-	messages_map[phone_number].append(message_entry)
+	# Build a new list: the loaded map is a shallow copy of the cached parse
+	messages_map[phone_number] = messages_map.get(phone_number, []) + [message_entry]
 	
 	# Keep only last 10 messages (increased from 5)
 	MAX_MESSAGES = 10
@@ -267,7 +305,7 @@ def _extract_tool_name_and_args(tool_call: Any) -> Tuple[str, Dict[str, Any]]:
 	if hasattr(tool_call, "name") and hasattr(tool_call, "arguments"):
 		name = str(getattr(tool_call, "name"))
 		args_json = getattr(tool_call, "arguments")
-		args = json.loads(args_json) if args_json else {}
+		args = _loads(args_json) if args_json else {}
 		return name, args
 	
 	# Responses API tool_use shape (with input as dict)
@@ -283,25 +321,42 @@ def _extract_tool_name_and_args(tool_call: Any) -> Tuple[str, Dict[str, Any]]:
 		fn = getattr(tool_call, "function")
 		name = str(getattr(fn, "name"))
 		args_json = getattr(fn, "arguments", None)
-		args = json.loads(args_json) if args_json else {}
+		args = _loads(args_json) if args_json else {}
 		return name, args
 	
 	raise ValueError("Unsupported tool_call shape")
 
 
-def _sanitize_tool_args(args: Dict[str, Any], thread_id: str) -> Dict[str, Any]:
-	"""Sanitize tool arguments: enforce phone_from from thread, remove unsafe phone fields."""
+def _phone_consuming_tools() -> FrozenSet[str]:
+	"""Get names of tools that need phone_from injected."""
+	global _PHONE_CONSUMING_TOOLS
+	if _PHONE_CONSUMING_TOOLS is None:
+		try:
+			from .tools import get_phone_from_tools
+		except ImportError:
+			_PHONE_CONSUMING_TOOLS = frozenset()
+		else:
+			_PHONE_CONSUMING_TOOLS = get_phone_from_tools()
+	return _PHONE_CONSUMING_TOOLS
+
+
+def _sanitize_tool_args(args: Dict[str, Any], thread_id: str, tool_name: Optional[str] = None) -> Dict[str, Any]:
+	"""Sanitize tool arguments: enforce phone_from from thread, remove unsafe phone fields.
+	
+	When tool_name is given and the tool does not consume phone_from, the
+	thread-map lookup is skipped; unsafe phone fields are always removed.
+	"""
 	sanitized = dict(args)
 	
 	# Get trusted phone from thread mapping
-	thread_phone = _lookup_phone_from_thread(thread_id)
-	if thread_phone:
-		sanitized["phone_from"] = thread_phone
+	if tool_name is None or tool_name in _phone_consuming_tools():
+		thread_phone = _lookup_phone_from_thread(thread_id)
+		if thread_phone:
+			sanitized["phone_from"] = thread_phone
 	
 	# Remove any user-supplied phone fields (security)
-	unsafe_keys = {"phone", "mobile", "mobile_no"}
 	for key in list(sanitized.keys()):
-		if str(key).lower() in unsafe_keys:
+		if str(key).lower() in _UNSAFE_PHONE_KEYS:
 			sanitized.pop(key, None)
 	
 	return sanitized
@@ -331,7 +386,7 @@ def _execute_function_tool(tool_call: Any, thread_id: str) -> str:
 	name, args = _extract_tool_name_and_args(tool_call)
 	
 	# Sanitize arguments for security
-	args = _sanitize_tool_args(args, thread_id)
+	args = _sanitize_tool_args(args, thread_id, name)
 	
 	# Get and execute tool implementation
 	from .tool_registry import get_tool_impl
@@ -343,7 +398,7 @@ def _execute_function_tool(tool_call: Any, thread_id: str) -> str:
 		_save_contact_profile(args, thread_id)
 	
 	# Return result as JSON string
-	return json.dumps(result, default=str) if not isinstance(result, str) else result
+	return _dumps(result) if not isinstance(result, str) else result
 
 
 def _build_initial_inputs(instructions: str, message: str, phone_number: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -386,28 +441,54 @@ def _build_initial_inputs(instructions: str, message: str, phone_number: Optiona
 	return inputs
 
 
+def _tool_error(tool_use: Any, exc: Exception) -> Tuple[str, bool]:
+	"""Log a failed tool use and return its (result, success) pair."""
+	_log().error("Tool %s FAILED: %s", getattr(tool_use, "name", ""), exc)
+	# Return error as tool result so AI knows it failed
+	return _dumps({"error": str(exc), "success": False}), False
+
+
+def _tool_outcome(tool_use: Any, thread_id: str) -> Tuple[str, bool]:
+	"""Execute tool_use and return (result, success), logging the outcome."""
+	tool_name = getattr(tool_use, "name", "")
+	try:
+		result = _execute_function_tool(tool_use, thread_id)
+		_log().info("Tool %s executed successfully, result length: %s", tool_name, len(str(result)))
+		return result, True
+	except Exception as exc:
+		_log().exception("Tool %s raised", tool_name)
+		return _tool_error(tool_use, exc)
+
+
+def _execute_tool_uses(tool_uses: Sequence[Any], thread_id: str) -> List[Tuple[str, bool]]:
+	"""Execute tool uses and return (result, success) pairs in the original order.
+	
+	Calls run through tool_executor: serially on the request's connection,
+	unless every tool in the batch is read-only.
+	"""
+	from .tools import ensure_tool_impl_registered
+	
+	tool_names = [getattr(tool_use, "name", "") for tool_use in tool_uses]
+	# Registration mutates the registry, so it happens before any fan-out
+	for tool_name in tool_names:
+		_log().info("Processing tool: %s", tool_name)
+		ensure_tool_impl_registered(tool_name)
+	
+	return execute_tool_calls(
+		tool_uses,
+		tool_names,
+		lambda tool_use: _tool_outcome(tool_use, thread_id),
+		_tool_error,
+	)
+
+
 def _process_tool_uses(
 	tool_uses: List[Any],
 	thread_id: str,
 	inputs: List[Dict[str, Any]]
 ) -> None:
 	"""Process and execute tool uses, appending results to inputs."""
-	from .tools import ensure_tool_impl_registered
-	
-	for tool_use in tool_uses:
-		tool_name = getattr(tool_use, "name", "")
-		_log().info(f"Processing tool: {tool_name}")
-		
-		ensure_tool_impl_registered(tool_name)
-		
-		try:
-			result = _execute_function_tool(tool_use, thread_id)
-			_log().info(f"Tool {tool_name} executed successfully, result length: {len(str(result))}")
-		except Exception as exc:
-			_log().exception(f"Tool {tool_name} FAILED: {exc}")
-			# Return error as tool result so AI knows it failed
-			result = json.dumps({"error": str(exc), "success": False})
-		
+	for tool_use, (result, _ok) in zip(tool_uses, _execute_tool_uses(tool_uses, thread_id)):
 		inputs.append({
 			"role": "tool",
 			"content": [{"type": "output_text", "text": result}],
@@ -456,6 +537,8 @@ def run_with_responses_api(
 	Returns:
 		Dict with final_output, thread_id (session_id), and model info
 	"""
+	from openai import BadRequestError
+	
 	from .assistant_update import get_current_instructions
 	from .assistant_spec import get_assistant_tools
 	from .config import apply_environment, get_environment
@@ -470,8 +553,8 @@ def run_with_responses_api(
 	if not api_key:
 		raise ValueError("OPENAI_API_KEY not configured. Set it in AI Assistant Settings or environment variables.")
 	
-	# Create OpenAI client with explicit API key
-	client = OpenAI(api_key=api_key)
+	# Reuse the shared OpenAI client (keeps pooled TLS connections alive)
+	client = get_openai_client(api_key)
 	thread_id = _ensure_thread_id(session_id)
 	
 	# Log request
@@ -494,8 +577,7 @@ def run_with_responses_api(
 	model = env.get("AI_ASSISTANT_MODEL") or DEFAULT_MODEL
 	
 	# Load previous response ID for continuity
-	resp_map = _load_responses_map()
-	prev_id = resp_map.get(thread_id)
+	prev_id = _get_response_id(thread_id)
 	
 	# Log conversation continuity status
 	if prev_id:
@@ -557,19 +639,12 @@ def run_with_responses_api(
 			# Execute tools and format results as user messages
 			# Responses API doesn't support role="tool", so we format as user messages
 			tool_results: List[str] = []
-			for tool_use in tool_uses:
+			for tool_use, (result, ok) in zip(tool_uses, _execute_tool_uses(tool_uses, thread_id)):
 				tool_name = getattr(tool_use, "name", "")
-				from .tools import ensure_tool_impl_registered
-				ensure_tool_impl_registered(tool_name)
-				
-				try:
-					result = _execute_function_tool(tool_use, thread_id)
-					_log().info(f"Tool {tool_name} executed successfully, result length: {len(str(result))}")
+				if ok:
 					tool_results.append(f"Function {tool_name} returned: {result}")
-				except Exception as exc:
-					_log().exception(f"Tool {tool_name} FAILED: {exc}")
-					error_result = json.dumps({"error": str(exc), "success": False})
-					tool_results.append(f"Function {tool_name} failed: {error_result}")
+				else:
+					tool_results.append(f"Function {tool_name} failed: {result}")
 			
 			# Add tool results as user message to inputs
 			if tool_results:
@@ -594,8 +669,7 @@ def run_with_responses_api(
 	# Save final response ID for next user message (conversation continuity)
 	# Always save the final response_id (it will be complete by now)
 	if current_response_id:
-		resp_map[thread_id] = current_response_id
-		_save_responses_map(resp_map)
+		_set_response_id(thread_id, current_response_id)
 		_log().info(f"Saved final response_id for session {thread_id}: {current_response_id[:20]}...")
 	else:
 		_log().debug("No response_id to save")
@@ -0,0 +1,117 @@
+"""Execution of the tool calls requested in one model turn.
+
+Shared by the Responses API loop (threads) and the Assistants API runs.
+Tools that write run one after another on the request's own database
+connection, so their changes commit or roll back with the request. Only a
+batch made entirely of read-only tools (READ_ONLY = True in the tool
+module) fans out to a thread pool, each worker with its own site context
+and a connection that is rolled back when it finishes.
+"""
+
+from __future__ import annotations
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Sequence, TypeVar
+
+import frappe
+from werkzeug.local import release_local
+
+from .logger_utils import get_resilient_logger
+
+# Upper bound on read-only tool calls executed concurrently for one model turn
+MAX_TOOL_WORKERS = 8
+
+T = TypeVar("T")
+
+
+def _log():
+	"""Get Frappe logger for tool_executor module."""
+	return get_resilient_logger("ai_module.tool_executor")
+
+
+def _has_pending_writes() -> bool:
+	"""Whether the request's transaction holds uncommitted writes."""
+	db = getattr(frappe.local, "db", None)
+	# Unknown counter: assume writes, parallel workers would not see them
+	return db is not None and getattr(db, "transaction_writes", 1) > 0
+
+
+def _can_run_in_parallel(tool_names: Sequence[str]) -> bool:
+	"""Whether a batch of tool calls may run concurrently in worker threads."""
+	if len(tool_names) < 2:
+		return False
+
+	from .tools import get_read_only_tools
+	read_only = get_read_only_tools()
+	if not all(name in read_only for name in tool_names):
+		return False
+
+	# Workers use their own connections and would not see this request's writes
+	return not _has_pending_writes()
+
+
+def _run_in_site(site: str, sites_path: str, user: str, execute: Callable[[Any], T], tool_call: Any) -> T:
+	"""Run execute(tool_call) in a worker thread with its own Frappe context.
+
+	The worker runs in a copy of the caller's context (so context variables
+	such as the tool call mode carry over); frappe.local is detached from
+	the caller's first, without closing its connection, and the worker
+	connects to the database as the calling user. Read-only tools have
+	nothing to commit, so the worker's transaction is always rolled back.
+	"""
+	release_local(frappe.local)
+	frappe.init(site=site, sites_path=sites_path)
+	try:
+		frappe.connect()
+		frappe.set_user(user)
+		try:
+			return execute(tool_call)
+		finally:
+			frappe.db.rollback()
+	finally:
+		frappe.destroy()
+
+
+def execute_tool_calls(
+	tool_calls: Sequence[Any],
+	tool_names: Sequence[str],
+	execute: Callable[[Any], T],
+	on_error: Callable[[Any, Exception], T],
+) -> List[T]:
+	"""Run execute(tool_call) for every call and return the results in order.
+
+	Args:
+		tool_calls: Tool calls requested by the model
+		tool_names: Tool name of each call, in the same order
+		execute: Runs one call; expected to turn tool errors into a result
+		on_error: Builds the result of a call whose worker failed to start
+
+	Calls run serially on the request's connection unless the batch is made
+	only of read-only tools and the request has no uncommitted writes.
+	"""
+	if not _can_run_in_parallel(tool_names):
+		return [execute(tool_call) for tool_call in tool_calls]
+
+	_log().info("Running %s read-only tool calls in parallel", len(tool_calls))
+	site = frappe.local.site
+	sites_path = frappe.local.sites_path
+	user = frappe.session.user
+
+	with ThreadPoolExecutor(max_workers=min(MAX_TOOL_WORKERS, len(tool_calls))) as executor:
+		# One context copy per call: a Context cannot be entered by two threads at once
+		futures = [
+			executor.submit(
+				contextvars.copy_context().run, _run_in_site, site, sites_path, user, execute, tool_call
+			)
+			for tool_call in tool_calls
+		]
+
+		results: List[T] = []
+		for tool_call, future in zip(tool_calls, futures):
+			try:
+				results.append(future.result())
+			except Exception as exc:
+				_log().error("Tool worker failed: %s", exc)
+				results.append(on_error(tool_call, exc))
+		return results
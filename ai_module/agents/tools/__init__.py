@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import importlib
 import pkgutil
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
 
 from ..tool_registry import register_tool_impl
 
@@ -10,6 +10,10 @@ from ..tool_registry import register_tool_impl
 _DISCOVERED: bool = False
 _NAME_TO_SCHEMA: Dict[str, Dict[str, Any]] = {}
 _NAME_TO_IMPL: Dict[str, str] = {}
+# Tools that receive the trusted phone_from (schema property or INJECT_PHONE_FROM = True)
+_PHONE_FROM_TOOLS: Set[str] = set()
+# Tools that only read data (READ_ONLY = True) and may run concurrently
+_READ_ONLY_TOOLS: Set[str] = set()
 
 
 def _extract_name_from_schema(schema: Dict[str, Any]) -> Optional[str]:
@@ -44,6 +48,11 @@ def _discover_tools() -> None:
 			if not name:
 				continue
 			_NAME_TO_SCHEMA[name] = schema
+			properties = (schema.get("function", {}).get("parameters") or {}).get("properties") or {}
+			if "phone_from" in properties or getattr(mod, "INJECT_PHONE_FROM", False):
+				_PHONE_FROM_TOOLS.add(name)
+			if getattr(mod, "READ_ONLY", False):
+				_READ_ONLY_TOOLS.add(name)
 
 			# Discover implementation
 			impl_dotted = getattr(mod, "IMPL_DOTTED_PATH", None)
@@ -75,6 +84,18 @@ def get_tool_schema_by_name(tool_name: str) -> Optional[Dict[str, Any]]:
 	return _NAME_TO_SCHEMA.get(tool_name)
 
 
+def get_phone_from_tools() -> FrozenSet[str]:
+	"""Names of tools that need phone_from injected from the thread mapping."""
+	_discover_tools()
+	return frozenset(_PHONE_FROM_TOOLS)
+
+
+def get_read_only_tools() -> FrozenSet[str]:
+	"""Names of tools declared read-only (safe to run outside the request's transaction)."""
+	_discover_tools()
+	return frozenset(_READ_ONLY_TOOLS)
+
+
 def register_all_tool_impls() -> None:
 	"""Register Python implementations for all known tools.
 
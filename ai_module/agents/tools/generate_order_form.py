@@ -261,3 +261,5 @@ def generate_order_confirmation_form(**kwargs) -> Dict[str, Any]:
         }
 
 IMPL_FUNC = generate_order_confirmation_form
+# phone_from is not in SCHEMA (the model must not supply it) but is injected by the executor
+INJECT_PHONE_FROM = True
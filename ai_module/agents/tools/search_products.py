@@ -82,3 +82,6 @@ def search_products(**kwargs) -> Dict[str, Any]:
 
 # Register callable implementation immediately during discovery
 IMPL_FUNC = search_products
+
+# Only queries products, so concurrent calls may run in parallel workers
+READ_ONLY = True
@@ -11,10 +11,15 @@ from typing import Dict, Any
 import frappe
 from frappe.model.document import Document
 
-from ai_module.agents.config import get_environment
-from ai_module.agents.assistant_spec import DEFAULT_INSTRUCTIONS
-from ai_module.agents.assistant_update import get_current_instructions
+from ai_module.agents.bootstrap import reinitialize
+from ai_module.agents.config import clear_assistant_id_cache, get_environment, reload_environment
+from ai_module.agents.assistant_spec import get_instructions
+from ai_module.agents.assistant_update import clear_instructions_cache, get_current_instructions
+from ai_module.agents import semantic_cache
+from ai_module.agents.assistants_api import DEFAULT_ASSISTANT_NAME
 from ai_module.agents.logger_utils import get_resilient_logger
+from ai_module.agents.openai_client import reset_openai_clients
+from ai_module.agents.threads import DEFAULT_MODEL
 
 
 def _log():
@@ -56,14 +61,7 @@ class AIAssistantSettings(Document):
 		Args:
 			pdf_changed: True if PDF file was changed, False otherwise
 		"""
-		from ai_module.agents.assistants_api import (
-			create_vector_store_with_file,
-			create_assistant_with_vector_store,
-			delete_vector_store,
-			delete_assistant,
-			update_assistant_on_openai
-		)
-		from ai_module.agents.assistant_spec import DEFAULT_INSTRUCTIONS
+		from ai_module.agents.assistants_api import update_assistant_on_openai
 		from ai_module.agents.config import apply_environment
 		import os
 		
@@ -82,12 +80,12 @@ class AIAssistantSettings(Document):
 			frappe.throw(f"PDF too large: {file_size_mb:.1f}MB (max 32MB)")
 		
 		# Get assistant name from doctype
-		assistant_name = getattr(self, 'assistant_name', None) or "CRM Assistant with Knowledge Base"
+		assistant_name = getattr(self, 'assistant_name', None) or DEFAULT_ASSISTANT_NAME
 		
 		# Get instructions and model (use get_current_instructions to apply placeholder replacement)
 		# Pass self to use current DocType instance (with unsaved changes)
 		instructions = get_current_instructions(settings_instance=self).strip()
-		model = self.model or "gpt-4o-mini"
+		model = self.model or DEFAULT_MODEL
 		
 		# If assistant already exists and PDF file hasn't changed, just update assistant config
 		# This prevents creating duplicate Vector Stores when re-saving with same PDF
@@ -119,28 +117,37 @@ class AIAssistantSettings(Document):
 	def _recreate_assistant(self, file_path: str, file_size_mb: float, assistant_name: str, instructions: str, model: str):
 		"""Recreate Vector Store and Assistant (used when PDF changes or assistant doesn't exist)."""
 		from ai_module.agents.assistants_api import (
+			_get_api_key,
 			create_vector_store_with_file,
 			create_assistant_with_vector_store,
 			delete_vector_store,
 			delete_assistant
 		)
+		from ai_module.agents.openai_client import get_openai_client
+		
+		# Resolve the client once for the whole delete/create sequence
+		api_key = _get_api_key()
+		if not api_key:
+			frappe.throw("OPENAI_API_KEY not configured")
+		client = get_openai_client(api_key)
 		
 		# Delete old resources if they exist
 		if self.vector_store_id:
-			delete_vector_store(self.vector_store_id)
+			delete_vector_store(self.vector_store_id, client=client)
 		if self.assistant_id:
-			delete_assistant(self.assistant_id)
+			delete_assistant(self.assistant_id, client=client)
 		
 		# Create new Vector Store with PDF
 		store_name = f"KB_{frappe.utils.now()}"
-		vector_store_id = create_vector_store_with_file(file_path, store_name)
+		vector_store_id = create_vector_store_with_file(file_path, store_name, client=client)
 		
 		# Create Assistant with file_search
 		assistant_id = create_assistant_with_vector_store(
 			vector_store_id=vector_store_id,
 			instructions=instructions,
 			model=model,
-			name=assistant_name
+			name=assistant_name,
+			client=client
 		)
 		
 		# Save IDs
@@ -179,8 +186,8 @@ class AIAssistantSettings(Document):
 		# Get current values (use get_current_instructions to apply placeholder replacement)
 		# Pass self to use current DocType instance (with unsaved changes)
 		instructions = get_current_instructions(settings_instance=self).strip() if instructions_changed else None
-		model = self.model or "gpt-4o-mini" if model_changed else None
-		assistant_name = (getattr(self, 'assistant_name', None) or "CRM Assistant with Knowledge Base") if name_changed else None
+		model = self.model or DEFAULT_MODEL if model_changed else None
+		assistant_name = (getattr(self, 'assistant_name', None) or DEFAULT_ASSISTANT_NAME) if name_changed else None
 		
 		_log().info(f"Updating OpenAI Assistant {self.assistant_id} due to field changes")
 		
@@ -252,11 +259,11 @@ class AIAssistantSettings(Document):
 		
 		# If override is enabled but model is empty, set default fallback
 		if use_settings and not self.get("model"):
-			self.model = "gpt-4o-mini"
+			self.model = DEFAULT_MODEL
 		
 		# If override is enabled but instructions is empty, populate with default prompt
 		if use_settings and not self.get("instructions"):
-			self.instructions = DEFAULT_INSTRUCTIONS
+			self.instructions = get_instructions()
 		
 		# Normalize instructions; allow empty and rely on runtime fallback
 		self.instructions = (self.instructions or "").strip()
@@ -283,6 +290,14 @@ class AIAssistantSettings(Document):
 		self._populate_readonly_from_env()
 
 	def on_update(self):
+		# Drop cached environment/config derived from the previous settings
+		reload_environment()
+		clear_assistant_id_cache(frappe.local.site)
+		clear_instructions_cache()
+		semantic_cache.clear()
+		reset_openai_clients()
+		reinitialize()
+		
 		# Upsert the Assistant whenever settings are saved, but skip during install
 		# or when provider credentials are not configured to avoid bricking install.
 		# IMPORTANT: If PDF context is enabled, DO NOT call upsert_assistant()
@@ -387,8 +402,8 @@ def ai_assistant_force_update_openai() -> Dict[str, Any]:
 		# Use get_current_instructions to apply placeholder replacement
 		# Pass settings to use current DocType instance
 		instructions = get_current_instructions(settings_instance=settings).strip()
-		model = settings.model or "gpt-4o-mini"
-		assistant_name = getattr(settings, 'assistant_name', None) or "CRM Assistant with Knowledge Base"
+		model = settings.model or DEFAULT_MODEL
+		assistant_name = getattr(settings, 'assistant_name', None) or DEFAULT_ASSISTANT_NAME
 		
 		_log().info(f"Forcing update of OpenAI Assistant {settings.assistant_id}")
 		
@@ -429,7 +444,22 @@ def ai_assistant_check_status() -> Dict[str, Any]:
 	Returns:
 		Dict with current configuration status
 	"""
-	settings = frappe.get_single("AI Assistant Settings")
+	# Fetch only the fields we report in one query instead of loading the full doc
+	settings = frappe.db.get_value(
+		"AI Assistant Settings",
+		None,
+		[
+			"enable_pdf_context",
+			"assistant_id",
+			"vector_store_id",
+			"knowledge_pdf",
+			"model",
+			"assistant_name",
+			"instructions",
+		],
+		as_dict=True,
+	) or frappe._dict()
+	using_openai = bool(settings.enable_pdf_context and settings.assistant_id)
 	
 	return {
 		"enable_pdf_context": bool(settings.enable_pdf_context),
@@ -437,8 +467,8 @@ def ai_assistant_check_status() -> Dict[str, Any]:
 		"vector_store_id": settings.vector_store_id or None,
 		"knowledge_pdf": settings.knowledge_pdf or None,
 		"model": settings.model or None,
-		"assistant_name": getattr(settings, 'assistant_name', None) or None,
+		"assistant_name": settings.assistant_name or None,
 		"instructions_length": len(settings.instructions or ""),
-		"using_openai": bool(settings.enable_pdf_context and settings.assistant_id),
-		"using_local": not bool(settings.enable_pdf_context and settings.assistant_id)
+		"using_openai": using_openai,
+		"using_local": not using_openai
 	} 
\ No newline at end of file
@@ -10,7 +10,7 @@ from typing import Any, Dict, List, Optional
 import frappe
 
 from .agents import Agent, register_agent, register_tool, list_agents, list_tools, run_agent
-from .agents.config import apply_environment, get_environment
+from .agents.config import apply_environment, get_environment, get_environment_fresh
 
 
 @frappe.whitelist(methods=["GET"])
@@ -21,8 +21,8 @@ def ai_debug_env() -> Dict[str, Any]:
 	
 	Note: With Responses API, we no longer persist assistant_id.
 	"""
+	env = get_environment_fresh()
 	apply_environment()
-	env = get_environment()
 	
 	# Get session map paths
 	thread_map_path = None
@@ -50,6 +50,10 @@ def ai_debug_env() -> Dict[str, Any]:
 		"OPENAI_ORG_ID",
 		"OPENAI_BASE_URL",
 		"AI_TOOL_CALL_MODE",
+		"AI_ASSISTANTS_STREAMING",
+		"AI_ASSISTANTS_BATCH_WINDOW_MS",
+		"AI_SEMANTIC_CACHE",
+		"AI_SEMANTIC_CACHE_THRESHOLD",
 	}
 
 	return {
@@ -425,14 +429,15 @@ def run_diagnostics():
 	try:
 		import platform
 		import sys
-		import os
+		
+		from .agents.runner import is_tool_call_mode
 		
 		system_info = {
 			"python_version": sys.version,
 			"platform": platform.platform(),
 			"frappe_version": frappe.__version__,
 			"site": frappe.local.site,
-			"environment": os.getenv('AI_TOOL_CALL_MODE', 'not_set')
+			"environment": "1" if is_tool_call_mode() else "not_set"
 		}
 		
 		log_check("system_info", "pass", "System information collected", system_info)
@@ -591,6 +596,17 @@ def delete_all_ai_files():
 				failed_files.append(f"{filename}: {str(e)}")
 				frappe.logger("ai_module.debug").error(f"Failed to delete {filename}: {str(e)}")
 		
+		# Response ids live in the site's KV database (open in other workers),
+		# so they are cleared rather than deleting the file
+		from .agents.kv_store import KV_DB_FILE
+		from .agents.threads import _clear_response_ids
+		try:
+			_clear_response_ids()
+			deleted_files.append(KV_DB_FILE)
+		except Exception as e:
+			failed_files.append(f"{KV_DB_FILE}: {str(e)}")
+			frappe.logger("ai_module.debug").error(f"Failed to clear response ids: {str(e)}")
+		
 		return {
 			"success": True,
 			"message": {
@@ -1026,7 +1026,7 @@ def get_conversation_memory(phone_number: str) -> Dict[str, Any]:
 		phone_number = phone_number.strip()
 		
 		# Import here to avoid circular imports
-		from .agents.threads import _load_json_map, _lookup_phone_from_thread
+		from .agents.threads import _get_response_id, _load_json_map, _lookup_phone_from_thread
 		
 		# Load thread mapping
 		thread_map = _load_json_map("ai_whatsapp_threads.json")
@@ -1040,14 +1040,11 @@ def get_conversation_memory(phone_number: str) -> Dict[str, Any]:
 				"phone_number": phone_number
 			}
 		
-		# Load response mapping to get conversation history
-		response_map = _load_json_map("ai_whatsapp_responses.json")
-		
-		# Get conversation data
+		# Get conversation data (response ids live in the kv store)
 		conversation_data = {
 			"phone_number": phone_number,
 			"thread_id": thread_id,
-			"last_response_id": response_map.get(thread_id),
+			"last_response_id": _get_response_id(thread_id),
 			"conversation_exists": True
 		}
 		
@@ -1097,19 +1094,19 @@ def list_all_conversations() -> Dict[str, Any]:
 			frappe.throw("Authentication required", frappe.PermissionError)
 		
 		# Import here to avoid circular imports
-		from .agents.threads import _load_json_map
+		from .agents.threads import _get_response_id, _load_json_map
 		
 		# Load thread mapping
 		thread_map = _load_json_map("ai_whatsapp_threads.json")
-		response_map = _load_json_map("ai_whatsapp_responses.json")
 		
 		conversations = []
 		for phone_number, thread_id in thread_map.items():
+			response_id = _get_response_id(thread_id)
 			conversation_info = {
 				"phone_number": phone_number,
 				"thread_id": thread_id,
-				"last_response_id": response_map.get(thread_id),
-				"has_response": bool(response_map.get(thread_id))
+				"last_response_id": response_id,
+				"has_response": bool(response_id)
 			}
 			conversations.append(conversation_info)
 		
@@ -172,12 +172,14 @@ def run_diagnostics():
 		import platform
 		import sys
 		
+		from .agents.runner import is_tool_call_mode
+		
 		system_info = {
 			"python_version": sys.version,
 			"platform": platform.platform(),
 			"frappe_version": frappe.__version__,
 			"site": frappe.local.site,
-			"environment": os.getenv('AI_TOOL_CALL_MODE', 'not_set')
+			"environment": "1" if is_tool_call_mode() else "not_set"
 		}
 		
 		log_check("system_info", "pass", "System information collected", system_info)
@@ -1,12 +1,13 @@
 import frappe
-import json
 import os
 import threading
 import time
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, Tuple
 
-from ai_module.agents.config import get_environment, apply_environment
+from ai_module.agents.config import get_ai_settings, get_environment, apply_environment
 from ai_module.agents.logger_utils import get_resilient_logger
+from ai_module.agents.map_files import load_json_map as _load_json_map, save_json_map as _save_json_map
+from ai_module.agents.message_args import ARGS_MARKER
 
 # Constants
 DEFAULT_COOLDOWN_SECONDS = 300
@@ -108,71 +109,6 @@ def _build_payload(doc) -> Dict[str, Any]:
 	}
 
 
-# Generic JSON map storage functions
-def _get_map_path(filename: str) -> str:
-	"""Get the full path for a JSON map file."""
-	return frappe.utils.get_site_path("private", "files", filename)
-
-
-def _load_json_map(filename: str) -> Dict[str, Any]:
-	"""Load a JSON map from file. Returns empty dict if file doesn't exist."""
-	try:
-		path = _get_map_path(filename)
-		if not os.path.exists(path):
-			return {}
-		
-		with open(path, "r", encoding="utf-8") as f:
-			data = f.read().strip()
-			if not data:
-				return {}
-			return json.loads(data)
-	except Exception as e:
-		_log().error(f"Failed to load JSON map {filename}: {e}")
-		# Try fallback from temp location
-		try:
-			import tempfile
-			temp_dir = tempfile.gettempdir()
-			temp_path = os.path.join(temp_dir, f"ai_module_{filename}")
-			if os.path.exists(temp_path):
-				with open(temp_path, "r", encoding="utf-8") as f:
-					data = f.read().strip()
-					if not data:
-						return {}
-					return json.loads(data)
-		except Exception as temp_e:
-			_log().error(f"Failed to load {filename} even from temp location: {temp_e}")
-		return {}
-
-
-def _save_json_map(filename: str, mapping: Dict[str, Any]) -> None:
-	"""Save a JSON map to file. Logs errors but doesn't raise."""
-	try:
-		path = _get_map_path(filename)
-		# Ensure directory exists with proper permissions
-		dir_path = os.path.dirname(path)
-		os.makedirs(dir_path, mode=0o755, exist_ok=True)
-		
-		# Write file with proper permissions
-		with open(path, "w", encoding="utf-8") as f:
-			json.dump(mapping, f, indent=2)
-		
-		# Set file permissions
-		os.chmod(path, 0o644)
-		
-	except Exception as e:
-		_log().error(f"Failed to save JSON map {filename}: {e}")
-		# Fallback: try to save in a temporary location
-		try:
-			import tempfile
-			temp_dir = tempfile.gettempdir()
-			temp_path = os.path.join(temp_dir, f"ai_module_{filename}")
-			with open(temp_path, "w", encoding="utf-8") as f:
-				json.dump(mapping, f, indent=2)
-			_log().info(f"Saved {filename} to temporary location: {temp_path}")
-		except Exception as temp_e:
-			_log().error(f"Failed to save {filename} even to temp location: {temp_e}")
-
-
 # Specific map accessors
 def _load_thread_map() -> Dict[str, str]:
 	"""Load phone -> thread_id mapping."""
@@ -214,17 +150,9 @@ def _save_handoff_map(mapping: Dict[str, float]) -> None:
 	_save_json_map(HANDOFF_MAP_FILE, mapping)
 
 
-def _get_ai_settings() -> Optional[Any]:
-	"""Get AI Assistant Settings singleton if it exists."""
-	try:
-		return frappe.get_single("AI Assistant Settings")
-	except Exception:
-		return None
-
-
 def _should_show_reaction() -> bool:
 	"""Check if reaction should be shown before AI processing."""
-	settings = _get_ai_settings()
+	settings = get_ai_settings()
 	if settings and getattr(settings, "use_settings_override", 0):
 		return bool(getattr(settings, "wa_enable_reaction", 0))
 	
@@ -234,7 +162,7 @@ def _should_show_reaction() -> bool:
 
 def _get_reaction_emoji() -> str:
 	"""Get the emoji to use for reactions from settings or environment."""
-	settings = _get_ai_settings()
+	settings = get_ai_settings()
 	if settings and getattr(settings, "use_settings_override", 0):
 		emoji = getattr(settings, "wa_reaction_emoji", None)
 		if emoji:
@@ -293,7 +221,7 @@ def _mark_human_activity(phone: str) -> None:
 def _human_cooldown_seconds() -> int:
 	"""Get human cooldown period in seconds from settings or environment."""
 	# Try DocType override first
-	settings = _get_ai_settings()
+	settings = get_ai_settings()
 	if settings and getattr(settings, "use_settings_override", 0):
 		cooldown = int(getattr(settings, "wa_human_cooldown_seconds", 0) or 0)
 		if cooldown > 0:
@@ -393,7 +321,7 @@ def _update_language_for_phone(phone: str, message_text: str) -> None:
 
 def _should_process_inline() -> bool:
 	"""Check if messages should be processed inline (synchronously)."""
-	settings = _get_ai_settings()
+	settings = get_ai_settings()
 	if settings and getattr(settings, "use_settings_override", 0):
 		return bool(getattr(settings, "wa_force_inline", 0))
 	
@@ -677,12 +605,12 @@ def _compose_ai_message(message_text: str, context_summary: Dict[str, Any], cont
 		composed = f"[non-text:{content_type}]"
 	
 	# Attach lightweight args for the agent to parse
-	return f"{composed}\n\n[args]: {frappe.as_json(context_summary)}"
+	return f"{composed}{ARGS_MARKER}{frappe.as_json(context_summary)}"
 
 
 def _should_autoreply() -> bool:
 	"""Check if auto-reply is enabled."""
-	settings = _get_ai_settings()
+	settings = get_ai_settings()
 	if settings and getattr(settings, "use_settings_override", 0):
 		return bool(getattr(settings, "wa_enable_autoreply", 0))
 	
@@ -844,7 +772,10 @@ def process_incoming_whatsapp_message(payload: Dict[str, Any]):
 			except Exception as mark_error:
 				logger.warning(f"Could not mark message as processed: {mark_error}")
 		
-		if should_autoreply:
+		if should_autoreply and isinstance(result, dict) and result.get("batched"):
+			# Merged into a pending batch: the batch's own run sends the reply
+			logger.info("PROCESS_INCOMING: Message merged into a pending batch, no separate reply")
+		elif should_autoreply:
 			reply_text = ""
 			if isinstance(result, dict):
 				reply_text = (result.get("final_output") or result.get("response") or "").strip()
@@ -270,8 +270,8 @@ def run_ai_tests(phone_number: str = "+393926012793") -> Dict[str, Any]:
 		log_debug("Testing WhatsApp settings...")
 		
 		try:
-			from .integrations.whatsapp import _should_process_inline, _should_autoreply, _get_ai_settings
-			from .agents.config import get_environment
+			from .integrations.whatsapp import _should_process_inline, _should_autoreply
+			from .agents.config import get_ai_settings, get_environment
 			
 			# Check inline processing
 			should_inline = _should_process_inline()
@@ -282,7 +282,7 @@ def run_ai_tests(phone_number: str = "+393926012793") -> Dict[str, Any]:
 			log_debug("Autoreply check", {"should_autoreply": should_autoreply})
 			
 			# Check AI settings
-			settings = _get_ai_settings()
+			settings = get_ai_settings()
 			log_debug("AI Settings", {
 				"settings_exists": settings is not None,
 				"use_settings_override": getattr(settings, "use_settings_override", None) if settings else None,
@@ -436,10 +436,11 @@ def run_ai_tests(phone_number: str = "+393926012793") -> Dict[str, Any]:
 		log_debug("Fixing WhatsApp settings...")
 		
 		try:
-			from .integrations.whatsapp import _get_ai_settings
-			
-			# Get current settings
-			settings = _get_ai_settings()
+			# Load a writable copy (get_ai_settings() returns the shared cached doc)
+			try:
+				settings = frappe.get_single("AI Assistant Settings")
+			except Exception:
+				settings = None
 			if not settings:
 				return {
 					"status": "error",
@@ -11,6 +11,7 @@ COME USARE:
 import frappe
 import json
 import os
+import sqlite3
 
 print("\n" + "🔍 "* 25)
 print("QUICK CLOUD DIAGNOSTIC - AI MODULE")
@@ -139,18 +140,24 @@ try:
     else:
         print(f"✅ Directory esiste")
         
-        # Verifica file
-        response_file = os.path.join(files_dir, "ai_whatsapp_responses.json")
-        if os.path.exists(response_file):
-            with open(response_file, "r") as f:
-                content = f.read().strip()
-            if content:
-                data = json.loads(content)
-                print(f"✅ ai_whatsapp_responses.json: {len(data)} sessioni")
+        # Verifica response IDs (tabella responses in ai_kv.sqlite)
+        kv_file = os.path.join(files_dir, "ai_kv.sqlite")
+        if os.path.exists(kv_file):
+            conn = sqlite3.connect(f"file:{kv_file}?mode=ro", uri=True)
+            try:
+                count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            finally:
+                conn.close()
+            if count:
+                print(f"✅ ai_kv.sqlite: {count} sessioni")
             else:
-                print(f"✅ ai_whatsapp_responses.json: vuoto (normale per primo avvio)")
+                print(f"✅ ai_kv.sqlite: nessuna sessione (normale per primo avvio)")
         else:
-            print(f"⚠️  ai_whatsapp_responses.json non esiste (sarà creato al primo messaggio)")
+            print(f"⚠️  ai_kv.sqlite non esiste (sarà creato al primo messaggio)")
+        
+        legacy_file = os.path.join(files_dir, "ai_whatsapp_responses.json")
+        if os.path.exists(legacy_file):
+            print(f"⚠️  ai_whatsapp_responses.json non ancora importato (verrà importato al primo messaggio)")
     
 except Exception as e:
     print(f"❌ ERRORE: {e}")
@@ -10,6 +10,7 @@ COME USARE:
 import frappe
 import json
 import os
+import sqlite3
 from datetime import datetime, timedelta
 
 def print_section(title):
@@ -81,15 +82,31 @@ def test_session_files():
     site_path = frappe.utils.get_site_path()
     files_dir = os.path.join(site_path, "private", "files")
     
+    all_ok = True
+    
+    # Response IDs (continuità conversazione) live in the responses table
+    kv_file = os.path.join(files_dir, "ai_kv.sqlite")
+    if os.path.exists(kv_file):
+        try:
+            conn = sqlite3.connect(f"file:{kv_file}?mode=ro", uri=True)
+            try:
+                count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            finally:
+                conn.close()
+            print(f"✅ ai_kv.sqlite: {count} entries - Response IDs (continuità conversazione)")
+        except sqlite3.Error as e:
+            print(f"❌ ai_kv.sqlite: {e} - Response IDs (continuità conversazione)")
+            all_ok = False
+    else:
+        print(f"❌ ai_kv.sqlite: NON ESISTE - Response IDs (continuità conversazione)")
+        all_ok = False
+    
     files = [
-        ("ai_whatsapp_responses.json", "Response IDs (continuità conversazione)"),
         ("ai_whatsapp_threads.json", "Phone -> Session mapping"),
         ("ai_whatsapp_lang.json", "Language preferences"),
         ("ai_whatsapp_handoffjson", "Human handoff status")
     ]
     
-    all_ok = True
-    
     for filename, description in files:
         filepath = os.path.join(files_dir, filename)
         